@@ -1,15 +1,70 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
 
+from . import images
+from .forms import PostAdminForm
 from .models import Comment, Follow, Group, Post
+from .pagination import EstimatedCountPaginator
+from .search import search_posts
 
 
-class PostAdmin(admin.ModelAdmin):
+class ProjectedChangeList(ChangeList):
+    """Changelist that loads only the columns listed in ``list_only``."""
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.model_admin.list_only:
+            queryset = queryset.only(*self.model_admin.list_only)
+        return queryset
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    Changelists that stay cheap on large tables: no full COUNT(*) for the
+    result counter, estimated counts for the paginator and, with
+    ``list_only``, no columns the list does not show.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_only = ()
+    empty_value_display = '-пусто-'
+
+    def get_changelist(self, request, **kwargs):
+        return ProjectedChangeList
+
+
+class PostAdmin(ScalableAdmin):
     list_display = (
         'pk', 'limited_text', 'pub_date', 'author', 'group', 'text', 'image'
     )
-    search_fields = ('text',)
+    list_select_related = ('author', 'group')
+    list_only = (
+        'id', 'text', 'pub_date', 'image',
+        'author__id', 'author__username', 'group__id', 'group__title',
+    )
+    # get_search_results() matches 'text' through the full-text index and
+    # the username exactly, through the unique index, instead of LIKE.
+    search_fields = ('text', 'author__username__exact')
     list_filter = ('pub_date',)
-    empty_value_display = '-пусто-'
+    date_hierarchy = 'pub_date'
+    autocomplete_fields = ('author', 'group')
+    form = PostAdminForm
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        # Every call builds a new class, so the flag stays per request.
+        form = super().get_form(request, obj, change, **kwargs)
+        form.oversized_field = images.oversized_field(request)
+        return form
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            Q(author__username=search_term)
+            | Q(pk__in=search_posts(search_term).values('pk'))
+        ), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -19,17 +74,29 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdmin):
     list_display = ('pk', 'post', 'author', 'text')
-    search_fields = ('author', 'text')
+    list_select_related = ('post__author', 'author')
+    list_only = (
+        'id', 'text', 'created',
+        'post__id', 'post__text', 'post__author__id',
+        'post__author__username', 'author__id', 'author__username',
+    )
+    search_fields = ('author__username__exact',)
     list_filter = ('created',)
-    empty_value_display = '-пусто-'
+    date_hierarchy = 'created'
+    raw_id_fields = ('post',)
+    autocomplete_fields = ('author',)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = ('user', 'author',)
-    search_fields = ('author', 'user')
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'author')
+    list_only = (
+        'id', 'user__id', 'user__username', 'author__id', 'author__username',
+    )
+    search_fields = ('user__username__exact', 'author__username__exact')
+    autocomplete_fields = ('user', 'author')
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,94 @@
+"""Query, row and time budgets for tests.
+
+``budget()`` measures the block it wraps: SQL queries, model instances
+built from fetched rows and wall time. Going over any limit fails with
+the executed queries, repeated ones (the usual N+1 culprits) marked
+with ``+``. ``within_budget`` does the same for a whole test.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import connection
+from django.db.models.signals import post_init
+from django.test.utils import CaptureQueriesContext
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+class Usage:
+    def __init__(self):
+        self.queries = []
+        self.rows = 0
+        self.ms = 0.0
+
+    def __repr__(self):
+        return (f'<Usage queries={len(self.queries)} rows={self.rows} '
+                f'ms={self.ms:.1f}>')
+
+
+def normalize(sql):
+    """The query with literals replaced, so that N+1 repeats compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    return re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+
+
+def query_report(queries):
+    counts = Counter(normalize(sql) for sql in queries)
+    return '\n'.join(
+        f'{"+" if count > 1 else " "} {count} x {sql}'
+        for sql, count in counts.items()
+    )
+
+
+def check(name, usage, queries=None, rows=None, ms=None):
+    over = []
+    if queries is not None and len(usage.queries) > queries:
+        over.append(f'{len(usage.queries)} queries (budget {queries})')
+    if rows is not None and usage.rows > rows:
+        over.append(f'{usage.rows} rows (budget {rows})')
+    if ms is not None and usage.ms > ms:
+        over.append(f'{usage.ms:.0f} ms (budget {ms} ms)')
+    if over:
+        raise BudgetExceeded(
+            f'{name} is over budget: {", ".join(over)}\n'
+            + query_report(usage.queries)
+        )
+
+
+@contextmanager
+def budget(name, queries=None, rows=None, ms=None):
+    """
+    Fail if the block runs more than ``queries`` SQL queries, builds more
+    than ``rows`` model instances or takes longer than ``ms``.
+    """
+    usage = Usage()
+
+    def count_row(**kwargs):
+        usage.rows += 1
+
+    post_init.connect(count_row, weak=False)
+    started = time.perf_counter()
+    try:
+        with CaptureQueriesContext(connection) as captured:
+            yield usage
+    finally:
+        usage.ms = (time.perf_counter() - started) * 1000
+        post_init.disconnect(count_row)
+    usage.queries = [query['sql'] for query in captured.captured_queries]
+    check(name, usage, queries, rows, ms)
+
+
+def within_budget(name=None, **limits):
+    """Decorator form of ``budget()`` for a whole test."""
+    def decorator(test):
+        @wraps(test)
+        def wrapper(*args, **kwargs):
+            with budget(name or test.__name__, **limits):
+                return test(*args, **kwargs)
+        return wrapper
+    return decorator
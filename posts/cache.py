@@ -0,0 +1,243 @@
+"""Versioned page cache.
+
+Every cached page is keyed by the current versions of the scopes it
+depends on (``global``, ``author:<username>``, ``group:<slug>``,
+``post:<id>``). Writes never delete cached pages: signal handlers bump the
+affected versions, so the next request builds a new key and stale entries
+expire after ``POSTS_CACHE_TIMEOUT``. Only the query parameters the views
+read are part of a page key, so made-up ones do not store extra copies.
+
+Values are computed through ``get_or_compute``, which lets a single worker
+rebuild a missing or expiring key while the others wait for it or keep
+serving the previous value.
+
+The same key doubles as the page's ETag, so browsers and proxies that
+revalidate with ``If-None-Match`` get a 304 without the page being
+rendered or even read from the cache.
+"""
+import hashlib
+import math
+import random
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control
+)
+from django.utils.http import quote_etag, urlencode
+
+from .timing import count_cache
+
+VERSION_KEY = 'posts:version:{}'
+PAGE_KEY = 'posts:page:{}:{}'
+COUNT_KEY = 'posts:count:{}:{}'
+LOCK_KEY = '{}:lock'
+PAGE_PARAMETERS = ('page', 'after', 'before', 'q')
+LOCK_POLL_INTERVAL = 0.05
+
+
+def new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def is_fresh(expires_at, delta, beta=1.0):
+    """
+    Probabilistic early expiration ("XFetch"): the closer the entry is to
+    expiring and the longer it took to compute, the more likely a reader
+    is to refresh it ahead of time.
+    """
+    if expires_at is None:
+        return True
+    jitter = -delta * beta * math.log(1.0 - random.random())
+    return time.time() + jitter < expires_at
+
+
+def store(key, value, delta, timeout):
+    """
+    Keep the entry for ``POSTS_CACHE_LOCK_TIMEOUT`` past its expiry, so
+    that other workers serve it while one of them computes the next value.
+    """
+    if timeout is None:
+        cache.set(key, (value, delta, None), None)
+        return
+    cache.set(
+        key, (value, delta, time.time() + timeout),
+        timeout + settings.POSTS_CACHE_LOCK_TIMEOUT
+    )
+
+
+def get_or_compute(key, compute, timeout=None, cacheable=None):
+    """
+    Return the cached value for ``key`` or compute and store it.
+
+    Only the worker that takes the lock runs ``compute``; the others serve
+    the stale value if there is one, or wait up to
+    ``POSTS_CACHE_LOCK_TIMEOUT`` for the lock holder to store a fresh one.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if is_fresh(expires_at, delta):
+            count_cache(hit=True)
+            return value
+
+    lock_key = LOCK_KEY.format(key)
+    lock_timeout = settings.POSTS_CACHE_LOCK_TIMEOUT
+    if cache.add(lock_key, True, lock_timeout):
+        count_cache(hit=False)
+        try:
+            started = time.monotonic()
+            value = compute()
+            delta = time.monotonic() - started
+            if cacheable is None or cacheable(value):
+                store(key, value, delta, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    count_cache(hit=entry is not None)
+    if entry is not None:
+        return entry[0]
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline and cache.get(lock_key):
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
+
+
+def get_versions(*scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    cache.set_many(
+        {VERSION_KEY.format(scope): new_version() for scope in scopes}, None
+    )
+
+
+def post_scopes(post, group_slugs=()):
+    scopes = {'global', f'post:{post.pk}', f'author:{post.author.username}'}
+    if post.group_id is not None:
+        scopes.add(f'group:{post.group.slug}')
+    scopes.update(f'group:{slug}' for slug in group_slugs if slug)
+    return scopes
+
+
+def prepare_cards(posts, user):
+    """
+    Attach what the post card fragment cache is keyed on: the post version
+    and whether the viewer is the author (who gets an edit link).
+    """
+    posts = list(posts)
+    versions = get_versions(*(f'post:{post.pk}' for post in posts))
+    for post, version in zip(posts, versions):
+        post.card_version = version
+        post.viewer_is_author = post.author_id == user.pk
+    return posts
+
+
+def get_viewer(request):
+    """
+    Part of the page key that depends on who is looking at the page.
+
+    Pages for authenticated users embed a CSRF token, so they are only
+    shared between requests that carry the same CSRF cookie.
+    """
+    if not request.user.is_authenticated:
+        return 'anonymous'
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    return f'{request.user.pk}:{csrf_cookie}'
+
+
+def page_key(view_name, request, viewer, versions):
+    query = urlencode([
+        (name, request.GET[name])
+        for name in PAGE_PARAMETERS if name in request.GET
+    ])
+    raw = '|'.join([request.path, query, viewer, *versions])
+    return PAGE_KEY.format(view_name, hashlib.md5(raw.encode()).hexdigest())
+
+
+def page_etag(key):
+    return quote_etag(key.rsplit(':', 1)[-1])
+
+
+def set_validators(response, etag, viewer):
+    """
+    Let clients keep the page but revalidate it on every use; pages of
+    authenticated users must not be stored by shared proxies.
+    """
+    if not response.has_header('ETag'):
+        response['ETag'] = etag
+    if viewer == 'anonymous':
+        patch_cache_control(response, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True, private=True)
+    return response
+
+
+def cached_count(name, queryset, *scopes):
+    """``queryset.count()`` cached until one of ``scopes`` is bumped."""
+    versions = get_versions(*scopes)
+    raw = '|'.join([*scopes, *versions])
+    return get_or_compute(
+        COUNT_KEY.format(name, hashlib.md5(raw.encode()).hexdigest()),
+        queryset.count,
+        settings.POSTS_CACHE_TIMEOUT,
+    )
+
+
+def is_cacheable(response):
+    return response.status_code == 200 and not response.streaming
+
+
+def cache_versioned(*scopes):
+    """
+    Cache a view until one of ``scopes`` is bumped and answer conditional
+    GETs with 304 while none of them is.
+
+    Scopes are formatted with the view's keyword arguments,
+    e.g. ``'group:{slug}'``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            viewer = get_viewer(request)
+            if request.method not in ('GET', 'HEAD') or viewer is None or \
+                    getattr(request, 'profiling', None):
+                return view(request, *args, **kwargs)
+
+            versions = get_versions(
+                *(scope.format(**kwargs) for scope in scopes)
+            )
+            key = page_key(view.__name__, request, viewer, versions)
+            etag = page_etag(key)
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return set_validators(response, etag, viewer)
+
+            response = get_or_compute(
+                key,
+                lambda: view(request, *args, **kwargs),
+                settings.POSTS_CACHE_TIMEOUT,
+                cacheable=is_cacheable,
+            )
+            if is_cacheable(response):
+                set_validators(response, etag, viewer)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def cache_timeout(request):
+    """Lifetime of the post card fragments, see ``post_item.html``."""
+    return {'posts_cache_timeout': settings.POSTS_CACHE_TIMEOUT}
@@ -1,14 +1,52 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
 
+from . import images
 from .models import Comment, Post
 
 
-class PostForm(ModelForm):
+class PostImageMixin:
+    """
+    Validates and re-encodes ``image`` (see ``posts/images.py``) in every
+    form that saves posts, the admin one included.
+
+    ``oversized_field`` is ``images.oversized_field(request)``: the upload
+    handler drops a file that is too large, so the form only learns about
+    it from the request.
+    """
+    oversized_field = None
+
+    def __init__(self, *args, oversized_field=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if oversized_field is not None:
+            self.oversized_field = oversized_field
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        if not isinstance(image, UploadedFile):
+            return image
+        if images.is_oversized(image):
+            raise images.oversized_error()
+        images.check_pixels(image)
+        return images.process(image)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.oversized_field == self.add_prefix('image'):
+            self.add_error('image', images.oversized_error())
+        return cleaned_data
+
+
+class PostForm(PostImageMixin, ModelForm):
     class Meta:
         model = Post
         fields = ('group', 'text', 'image',)
 
 
+class PostAdminForm(PostImageMixin, ModelForm):
+    """Base of the post form ``PostAdmin`` builds from its fieldsets."""
+
+
 class CommentForm(ModelForm):
     class Meta:
         model = Comment
@@ -0,0 +1,105 @@
+"""Bounded processing of uploaded post images.
+
+Uploads are streamed to a temporary file by ``LimitedUploadHandler``,
+which stops reading the request as soon as a file passes
+``POSTS_UPLOAD_MAX_BYTES``; the form then reports the file as too large.
+Files that fit are rejected if they have too many pixels judging by the
+header alone, before any decoding. Accepted images are decoded at the
+smallest scale the format allows, rotated according to EXIF, shrunk to
+``POSTS_IMAGE_MAX_SIDE`` and re-encoded as progressive JPEG without any
+metadata.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (StopUpload,
+                                             TemporaryFileUploadHandler)
+from PIL import Image, ImageOps
+
+JPEG_QUALITY = 85
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every upload to disk and stops parsing the request at the
+    first file past ``POSTS_UPLOAD_MAX_BYTES``, without reading the rest
+    of the body. The file's field is left in ``request.oversized_field``
+    (see ``oversized_field()``); the file and the fields after it are
+    missing from the request.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.POSTS_UPLOAD_MAX_BYTES:
+            self.request.oversized_field = self.field_name
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def oversized_field(request):
+    """Name of the field whose file was cut off, if any."""
+    request.FILES  # Parses the body, if it has not been yet.
+    return getattr(request, 'oversized_field', None)
+
+
+def is_oversized(upload):
+    return upload.size > settings.POSTS_UPLOAD_MAX_BYTES
+
+
+def oversized_error():
+    return ValidationError(
+        'Файл слишком большой: не больше %(limit)s МБ.',
+        code='file_too_large',
+        params={'limit': settings.POSTS_UPLOAD_MAX_BYTES // 2 ** 20},
+    )
+
+
+def check_pixels(upload):
+    """Reject images with too many pixels reading only their header."""
+    upload.seek(0)
+    with Image.open(upload) as image:
+        width, height = image.size
+    if width * height > settings.POSTS_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Изображение слишком большое: не больше %(limit)s мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': settings.POSTS_IMAGE_MAX_PIXELS // 10 ** 6},
+        )
+
+
+def flatten(image):
+    """Drop transparency onto white, JPEG has no alpha channel."""
+    if image.mode in ('RGBA', 'LA') or \
+            (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def process(upload):
+    """Shrunk, EXIF-free progressive JPEG copy of ``upload``."""
+    max_side = settings.POSTS_IMAGE_MAX_SIDE
+    upload.seek(0)
+    with Image.open(upload) as image:
+        # JPEG can decode straight at 1/2, 1/4 or 1/8 of the size.
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image = flatten(image)
+
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+        dir=settings.FILE_UPLOAD_TEMP_DIR,
+    )
+    image.save(
+        output, 'JPEG',
+        quality=JPEG_QUALITY, optimize=True, progressive=True,
+    )
+    size = output.tell()
+    output.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0] + '.jpg'
+    return UploadedFile(output, name, 'image/jpeg', size)
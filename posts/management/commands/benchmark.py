@@ -0,0 +1,336 @@
+import json
+import math
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY, get_user_model)
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+VIEWS = (
+    'index', 'group_posts', 'profile', 'post_view', 'follow_index',
+    'new_post', 'add_comment',
+)
+# Views that need a logged-in user; the rest are requested anonymously.
+LOGIN_REQUIRED = {'follow_index', 'new_post', 'add_comment'}
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class TestClient:
+    """Requests through the Django test client; SQL queries are counted."""
+    concurrent = False
+
+    def __init__(self, user):
+        self.anonymous = Client()
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, method, path, data, login):
+        client = self.client if login else self.anonymous
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(path, data)
+        return response.status_code, len(queries)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Requests to a running server, e.g. a local gunicorn."""
+    concurrent = True
+
+    def __init__(self, user, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(NoRedirect)
+        # The session Client.force_login() would create, plus a CSRF
+        # cookie and the matching form token for POST requests.
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        request = HttpRequest()
+        self.csrf_token = get_token(request)
+        self.cookie = (
+            f'{settings.SESSION_COOKIE_NAME}={session.session_key}; '
+            f'{settings.CSRF_COOKIE_NAME}={request.META["CSRF_COOKIE"]}'
+        )
+
+    def request(self, method, path, data, login):
+        body = None
+        if method == 'post':
+            body = urllib.parse.urlencode(
+                {**data, 'csrfmiddlewaretoken': self.csrf_token}
+            ).encode()
+        request = urllib.request.Request(self.base_url + path, body)
+        if login:
+            request.add_header('Cookie', self.cookie)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as error:
+            return error.code, None
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест лент, страницы записи, публикации и '
+        'комментирования: задержки p50/p95/p99, пропускная способность '
+        'и число SQL-запросов в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'views',
+            nargs='*',
+            metavar='view',
+            help=f'Что измерять: {", ".join(VIEWS)} (по умолчанию всё)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Сколько запросов к каждому представлению',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=5,
+            help='Сколько запросов сделать до начала измерений',
+        )
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, например, http://127.0.0.1:8000; '
+                 'без него запросы идут через тестовый клиент Django, '
+                 'а изменения откатываются',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Сколько запросов к серверу выполнять параллельно '
+                 '(только с --url)',
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кеш перед каждым запросом',
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Сохранить результаты в JSON-файл',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Сравнить с результатами из JSON-файла',
+        )
+
+    def handle(self, *args, **options):
+        views = options['views'] or list(VIEWS)
+        unknown = set(views) - set(VIEWS)
+        if unknown:
+            raise CommandError(f'Unknown views: {", ".join(sorted(unknown))}')
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        if options['concurrency'] > 1 and not options['url']:
+            raise CommandError('--concurrency needs --url')
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING(
+                'DEBUG is on: timings include its overhead'
+            ))
+        self.options = options
+
+        targets = self.targets()
+        if options['url']:
+            client = HttpClient(targets['reader'], options['url'])
+            results = self.run(client, views, targets)
+        else:
+            # Writes made by new_post and add_comment are rolled back.
+            with transaction.atomic(), override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+            ):
+                client = TestClient(targets['reader'])
+                results = self.run(client, views, targets)
+                transaction.set_rollback(True)
+
+        report = {
+            'revision': git_revision(),
+            'mode': options['url'] or 'test client',
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'cold_cache': options['cold'],
+            'dataset': {
+                model._meta.model_name: model.objects.count()
+                for model in (User, Group, Post, Comment, Follow)
+            },
+            'views': results,
+        }
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                self.print_comparison(json.load(baseline_file), report)
+
+    def targets(self):
+        """The busiest author, reader, group and post of the dataset."""
+        author = UserStats.objects.select_related('user').order_by(
+            '-posts_count'
+        ).first()
+        reader = UserStats.objects.select_related('user').order_by(
+            '-following_count'
+        ).first()
+        group = Group.objects.annotate(
+            posts_count=Count('posts')
+        ).order_by('-posts_count').first()
+        post = Post.objects.select_related('author').order_by(
+            '-comment_count', '-pk'
+        ).first()
+        if None in (author, reader, group, post):
+            raise CommandError('Not enough data, run seed_data first')
+        return {
+            'author': author.user, 'reader': reader.user,
+            'group': group, 'post': post,
+        }
+
+    def requests(self, view, targets):
+        """``(method, path, data)`` of a request to ``view``."""
+        post = targets['post']
+        post_kwargs = {'username': post.author.username, 'post_id': post.pk}
+        if view == 'index':
+            return 'get', reverse('index'), {}
+        if view == 'group_posts':
+            return 'get', reverse('group', args=[targets['group'].slug]), {}
+        if view == 'profile':
+            return 'get', reverse(
+                'profile', args=[targets['author'].username]
+            ), {}
+        if view == 'post_view':
+            return 'get', reverse('post', kwargs=post_kwargs), {}
+        if view == 'follow_index':
+            return 'get', reverse('follow_index'), {}
+        if view == 'new_post':
+            return 'post', reverse('new_post'), {
+                'text': 'benchmark', 'group': targets['group'].pk
+            }
+        return 'post', reverse('add_comment', kwargs=post_kwargs), {
+            'text': 'benchmark'
+        }
+
+    def run(self, client, views, targets):
+        results = {}
+        for view in views:
+            method, path, data = self.requests(view, targets)
+            login = view in LOGIN_REQUIRED
+
+            def timed(_=None):
+                if self.options['cold']:
+                    cache.clear()
+                started = time.perf_counter()
+                status, queries = client.request(method, path, data, login)
+                return time.perf_counter() - started, status, queries
+
+            for _ in range(self.options['warmup']):
+                timed()
+            started = time.perf_counter()
+            if client.concurrent and self.options['concurrency'] > 1:
+                with ThreadPoolExecutor(self.options['concurrency']) as pool:
+                    samples = list(pool.map(
+                        timed, range(self.options['requests'])
+                    ))
+            else:
+                samples = [timed() for _ in range(self.options['requests'])]
+            results[view] = self.summarize(
+                samples, time.perf_counter() - started
+            )
+        return results
+
+    def summarize(self, samples, elapsed):
+        latencies = sorted(latency * 1000 for latency, _, _ in samples)
+        queries = [count for _, _, count in samples if count is not None]
+        summary = {
+            f'p{rank}_ms': round(percentile(latencies, rank), 2)
+            for rank in PERCENTILES
+        }
+        summary.update({
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'max_ms': round(latencies[-1], 2),
+            'rps': round(len(samples) / elapsed, 1),
+            'errors': sum(status >= 400 for _, status, _ in samples),
+            'queries_mean': (
+                round(sum(queries) / len(queries), 1) if queries else None
+            ),
+            'queries_max': max(queries) if queries else None,
+        })
+        return summary
+
+    def print_report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{report["mode"]}, {report["requests"]} requests per view, '
+            f'dataset: {report["dataset"]}'
+        ))
+        for view, result in report['views'].items():
+            self.stdout.write(
+                f'{view:<14} p50 {result["p50_ms"]:>8} ms  '
+                f'p95 {result["p95_ms"]:>8} ms  '
+                f'p99 {result["p99_ms"]:>8} ms  '
+                f'{result["rps"]:>7} rps  '
+                f'queries {result["queries_max"]}  '
+                f'errors {result["errors"]}'
+            )
+
+    def print_comparison(self, baseline, report):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Compared with {baseline.get("revision") or "baseline"}'
+        ))
+        for view, result in report['views'].items():
+            old = baseline.get('views', {}).get(view)
+            if old is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                change = (result[key] - old[key]) / (old[key] or 1) * 100
+                changes.append(f'{key[:-3]} {change:+.0f}%')
+            if old.get('queries_max') != result['queries_max']:
+                changes.append(
+                    f'queries {old.get("queries_max")} -> '
+                    f'{result["queries_max"]}'
+                )
+            self.stdout.write(f'{view:<14} ' + ', '.join(changes))
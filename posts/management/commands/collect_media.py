@@ -0,0 +1,187 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import MediaFile, Post
+from posts.thumbnails import source_file
+
+BATCH_SIZE = 1000
+
+
+def walk(storage, directory):
+    """Lazily yield ``(name, size, mtime)`` of files under ``directory``."""
+    root = storage.path(directory)
+    if not os.path.isdir(root):
+        return
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    name = os.path.relpath(entry.path, storage.location)
+                    yield (name.replace(os.sep, '/'), stat.st_size,
+                           stat.st_mtime)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки и миниатюры, на которые не ссылаются записи'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать, сколько места можно освободить',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=24,
+            help='Не трогать файлы без записи в MediaFile моложе стольких '
+                 'часов (загрузки, которые ещё не закоммичены)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько файлов сверять с базой за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.cutoff = time.time() - options['min_age'] * 3600
+        self.batch_size = options['batch_size']
+        images, images_size, thumbnails, thumbnails_size = (
+            self.collect_images()
+        )
+        stale, stale_size = self.collect_stale_sources()
+        stray, stray_size = self.collect_thumbnails()
+        verb = 'Reclaimable' if self.dry_run else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: images {images} ({images_size} bytes), '
+            f'thumbnails {thumbnails + stale + stray} '
+            f'({thumbnails_size + stale_size + stray_size} bytes)'
+        ))
+
+    def orphans(self, chunk):
+        """
+        ``{name: size}`` of the files in ``chunk`` nothing refers to.
+
+        The ``MediaFile`` rows are locked in the transaction that deletes
+        them: an upload reusing one of the files either has raised its
+        ``references`` already or waits for the lock and stores the file
+        anew. A new file is written before its row, so files without one
+        are only taken past ``--min-age``.
+        """
+        sizes = {name: size for name, size, _ in chunk}
+        references = dict(MediaFile.objects.select_for_update().filter(
+            name__in=list(sizes)
+        ).values_list('name', 'references'))
+        referenced = set(Post.objects.filter(
+            image__in=list(sizes)
+        ).values_list('image', flat=True))
+        return {
+            name: size for name, size, mtime in chunk
+            if name not in referenced and (
+                references[name] == 0 if name in references
+                else mtime < self.cutoff
+            )
+        }
+
+    def collect_images(self):
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        images = images_size = thumbnails = thumbnails_size = 0
+        for chunk in chunked(walk(storage, field.upload_to), self.batch_size):
+            with transaction.atomic():
+                orphans = self.orphans(chunk)
+                if not self.dry_run:
+                    MediaFile.objects.filter(name__in=list(orphans)).delete()
+            for name, size in orphans.items():
+                count, size_of_thumbnails = self.thumbnail_usage(
+                    source_file(name)
+                )
+                thumbnails += count
+                thumbnails_size += size_of_thumbnails
+                images_size += size
+                if not self.dry_run:
+                    storage.delete_file(name)
+            images += len(orphans)
+        return images, images_size, thumbnails, thumbnails_size
+
+    def thumbnail_usage(self, source):
+        """Number and total size of the stored thumbnails of ``source``."""
+        keys = default.kvstore._get(source.key, identity='thumbnails') or []
+        size = 0
+        for key in keys:
+            thumbnail = default.kvstore._get(key)
+            if thumbnail is not None and thumbnail.exists():
+                size += thumbnail.storage.size(thumbnail.name)
+        return len(keys), size
+
+    def collect_stale_sources(self):
+        """
+        Thumbnails whose image is gone, such as images deleted before the
+        storage removed thumbnails along with them.
+        """
+        prefix = add_prefix('', identity='thumbnails')
+        count = size = 0
+        last_key = ''
+        while True:
+            keys = list(KVStore.objects.filter(
+                key__startswith=prefix, key__gt=last_key
+            ).order_by('key').values_list('key', flat=True)[:self.batch_size])
+            if not keys:
+                return count, size
+            last_key = keys[-1]
+            for key in keys:
+                source = default.kvstore._get(key[len(prefix):])
+                if source is None or source.exists():
+                    continue
+                thumbnails, thumbnails_size = self.thumbnail_usage(source)
+                count += thumbnails
+                size += thumbnails_size
+                if not self.dry_run:
+                    default.kvstore.delete(source)
+
+    def collect_thumbnails(self):
+        """Thumbnail files the key-value store no longer knows about."""
+        storage = default.storage
+        count = size = 0
+        files = walk(storage, sorl_settings.THUMBNAIL_PREFIX)
+        for chunk in chunked(files, self.batch_size):
+            candidates = {
+                add_prefix(ImageFile(name, storage).key): (name, file_size)
+                for name, file_size, mtime in chunk if mtime < self.cutoff
+            }
+            known = set(KVStore.objects.filter(
+                key__in=list(candidates)
+            ).values_list('key', flat=True))
+            for key, (name, file_size) in candidates.items():
+                if key in known:
+                    continue
+                count += 1
+                size += file_size
+                if not self.dry_run:
+                    storage.delete(name)
+        return count, size
@@ -0,0 +1,121 @@
+import json
+import random
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from posts import seeding, timeline
+from posts.models import Group, Post, UserStats
+from posts.views import POSTS_PER_PAGE
+
+TABLES = ('posts_post', 'posts_comment', 'posts_follow', 'posts_userstats')
+
+
+class Command(BaseCommand):
+    help = 'Выводит планы запросов лент (EXPLAIN) для поиска регрессий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Сгенерировать столько постов; данные откатываются',
+        )
+        parser.add_argument(
+            '--output',
+            help='Сохранить планы в JSON-файл',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Сравнить с планами из JSON-файла',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            plans = {
+                name: self.explain(queryset)
+                for name, queryset in self.queries().items()
+            }
+            transaction.set_rollback(True)
+
+        for name, plan in plans.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(plans, output, ensure_ascii=False, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            changed = [
+                name for name, plan in plans.items()
+                if normalize(plan) != normalize(baseline.get(name, ''))
+            ]
+            if changed:
+                raise CommandError(f'Plans changed: {", ".join(changed)}')
+            self.stdout.write(self.style.SUCCESS('Plans are unchanged'))
+
+    def queries(self):
+        author = UserStats.objects.order_by('-posts_count').first()
+        reader = UserStats.objects.order_by('-following_count').first()
+        group = Group.objects.annotate(
+            posts_count=Count('posts')
+        ).order_by('-posts_count').first()
+        post = Post.objects.annotate(
+            comments_count=Count('comments')
+        ).order_by('-comments_count').first()
+        if None in (author, reader, group, post):
+            raise CommandError('Not enough data, run with --seed')
+
+        queries = {
+            'index': Post.objects.feed()[:POSTS_PER_PAGE],
+            'group_posts': group.posts.feed()[:POSTS_PER_PAGE],
+            'profile': Post.objects.feed().filter(
+                author_id=author.user_id
+            )[:POSTS_PER_PAGE],
+            'post_view_comments': post.comments.select_related('author'),
+        }
+        feed = timeline.posts_for(reader.user)
+        if isinstance(feed, timeline.Feed):
+            # A page is one query per source; authors share one plan.
+            entries, *fanned_in = feed.sources()
+            queries['follow_index'] = entries[:POSTS_PER_PAGE]
+            if fanned_in:
+                queries['follow_index_fanned_in'] = (
+                    fanned_in[0][:POSTS_PER_PAGE]
+                )
+        else:
+            queries['follow_index'] = feed[:POSTS_PER_PAGE]
+        return queries
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            return queryset.explain(costs=False)
+        return queryset.explain()
+
+    def seed(self, posts_count):
+        seeding.seed(
+            users=max(posts_count // 10, 2),
+            posts=posts_count,
+            comments=posts_count,
+            follows=20,
+            groups=5,
+            prefix='explain',
+            rng=random.Random(posts_count),
+            stdout=self.stdout,
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for table in TABLES:
+                    cursor.execute(f'ANALYZE {table}')
+
+
+def normalize(plan):
+    """Drop node ids and estimates so only the plan shape is compared."""
+    return re.sub(r'\d+', 'N', plan).strip()
@@ -0,0 +1,158 @@
+import csv
+import gzip
+from contextlib import nullcontext
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Group, Post
+
+CHUNK_SIZE = 2000
+
+# Model, then the lookups the --since/--until, --author and --group filters
+# use on it; None means the filter does not apply to the model.
+EXPORTS = {
+    'groups': (Group, None, None, 'slug'),
+    'posts': (Post, 'pub_date', 'author__username', 'group__slug'),
+    'comments': (
+        Comment, 'created', 'author__username', 'post__group__slug'
+    ),
+    'follows': (Follow, None, 'author__username', None),
+}
+
+
+def day_start(value):
+    """Midnight of an ISO date in the current time zone."""
+    return timezone.make_aware(
+        datetime.combine(date.fromisoformat(value), time.min)
+    )
+
+
+def open_output(path):
+    if path in (None, '-'):
+        return None
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает группы, записи, комментарии и подписки '
+        'в JSON Lines или CSV'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models',
+            nargs='*',
+            metavar='model',
+            help=f'Что выгружать: {", ".join(EXPORTS)} (по умолчанию всё)',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('jsonl', 'csv'),
+            default='jsonl',
+            help='jsonl — записи в формате dumpdata, по одной на строку; '
+                 'csv — только для одной модели',
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Файл для выгрузки (по умолчанию stdout); '
+                 'файлы с расширением .gz сжимаются',
+        )
+        parser.add_argument(
+            '--since',
+            type=day_start,
+            help='Записи и комментарии начиная с этой даты (ГГГГ-ММ-ДД)',
+        )
+        parser.add_argument(
+            '--until',
+            type=day_start,
+            help='Записи и комментарии до этой даты, не включая её',
+        )
+        parser.add_argument(
+            '--author',
+            help='Только записи, комментарии и подписчики этого автора',
+        )
+        parser.add_argument(
+            '--group',
+            help='Только эта группа, её записи и комментарии к ним',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько строк читать из курсора за раз',
+        )
+
+    def handle(self, *args, **options):
+        names = options['models'] or list(EXPORTS)
+        unknown = set(names) - set(EXPORTS)
+        if unknown:
+            raise CommandError(f'Unknown models: {", ".join(sorted(unknown))}')
+        if options['format'] == 'csv' and len(names) != 1:
+            raise CommandError('CSV export takes exactly one model')
+        write_rows = getattr(self, f'write_{options["format"]}')
+
+        output = open_output(options['output'])
+        totals = []
+        with output or nullcontext(self.stdout) as stream:
+            for name in names:
+                count = write_rows(stream, *self.rows(name, options))
+                totals.append(f'{name} {count}')
+        # Progress goes to stderr so that stdout can carry the export.
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported: {", ".join(totals)}'
+        ))
+
+    def rows(self, name, options):
+        """Lazily read ``(pk, *fields)`` tuples without building models."""
+        model, date_field, author_field, group_field = EXPORTS[name]
+        fields = [
+            field for field in model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        queryset = model.objects.all()
+        if date_field and options['since']:
+            queryset = queryset.filter(**{f'{date_field}__gte':
+                                          options['since']})
+        if date_field and options['until']:
+            queryset = queryset.filter(**{f'{date_field}__lt':
+                                          options['until']})
+        if author_field and options['author']:
+            queryset = queryset.filter(**{author_field: options['author']})
+        if group_field and options['group']:
+            queryset = queryset.filter(**{group_field: options['group']})
+        rows = queryset.order_by('pk').values_list(
+            'pk', *(field.attname for field in fields)
+        ).iterator(chunk_size=options['chunk_size'])
+        return model, fields, rows
+
+    def write_jsonl(self, stream, model, fields, rows):
+        label = model._meta.label_lower
+        names = [field.name for field in fields]
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        count = 0
+        for pk, *values in rows:
+            stream.write(encoder.encode({
+                'model': label,
+                'pk': pk,
+                'fields': dict(zip(names, values)),
+            }) + '\n')
+            count += 1
+        return count
+
+    def write_csv(self, stream, model, fields, rows):
+        writer = csv.writer(stream)
+        writer.writerow(['pk', *(field.name for field in fields)])
+        count = 0
+        for row in rows:
+            writer.writerow([
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in row
+            ])
+            count += 1
+        return count
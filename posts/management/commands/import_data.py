@@ -0,0 +1,275 @@
+import gzip
+import itertools
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers import base, python
+from django.db import connection, transaction
+
+from posts import cache, timeline
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+READ_SIZE = 1 << 16
+
+# Models are loaded level by level, one pass over the file per level, so
+# every committed batch only references rows committed before it.
+LEVELS = (
+    (User, Group),
+    (Post, Follow),
+    (Comment,),
+)
+MODELS = [model for level in LEVELS for model in level]
+# Rebuilt from the imported rows at the end instead of being loaded.
+DERIVED = {'posts.userstats', 'posts.timelineentry', 'posts.mediafile'}
+
+
+def open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def read_array(source, decoder):
+    """Decode a JSON array (dumpdata output) one element at a time."""
+    buffer = ''
+    while True:
+        chunk = source.read(READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in '[, \t\r\n':
+                position += 1
+            if buffer.startswith(']', position):
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield record
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise CommandError('Unexpected end of fixture')
+            return
+
+
+def read_records(path):
+    """Records of a dumpdata JSON fixture or JSON Lines export, lazily."""
+    decoder = json.JSONDecoder()
+    with open_input(path) as source:
+        head = source.read(1)
+        while head.isspace():
+            head = source.read(1)
+        if head == '[':
+            yield from read_array(source, decoder)
+            return
+        for line in itertools.chain([head + source.readline()], source):
+            if line.strip():
+                yield decoder.decode(line)
+
+
+@contextmanager
+def indexes_dropped(models):
+    """Drop secondary indexes for the duration of a load, then rebuild."""
+    indexes = [(model, index) for model in models
+               for index in model._meta.indexes]
+    with connection.schema_editor() as editor:
+        for model, index in indexes:
+            editor.remove_index(model, index)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                editor.add_index(model, index)
+
+
+@contextmanager
+def dates_kept(model):
+    """
+    Keep the dates of the loaded rows: ``bulk_create`` would stamp
+    ``auto_now_add`` fields such as ``Post.pub_date`` with the time of
+    the import.
+    """
+    fields = [
+        (field, field.auto_now, field.auto_now_add)
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    for field, _, _ in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        'Быстро загружает пользователей, группы, записи, комментарии и '
+        'подписки из фикстуры dumpdata или выгрузки export_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='JSON-фикстура или JSON Lines, можно сжатые gzip (.gz)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько строк вставлять одним запросом и одной транзакцией',
+        )
+        parser.add_argument(
+            '--skip-existing',
+            action='store_true',
+            help='Пропускать строки, которые уже есть в базе',
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            help='Удалить вторичные индексы на время загрузки '
+                 'и построить их заново в конце',
+        )
+
+    def handle(self, *args, **options):
+        self.path = options['path']
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.skip_existing = options['skip_existing']
+        self.counts = Counter()
+        self.skipped = Counter()
+
+        started = time.monotonic()
+        if options['defer_indexes']:
+            with indexes_dropped((Post, Comment, Follow)):
+                self.load_all()
+        else:
+            self.load_all()
+        elapsed = time.monotonic() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported: {total} rows in {elapsed:.1f} s '
+            f'({total / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
+        for model in MODELS:
+            self.stdout.write(f'  {model._meta.label}: {self.counts[model]}')
+        if self.skipped:
+            self.stdout.write(
+                'Skipped, use loaddata for these: ' + ', '.join(
+                    f'{label} {count}'
+                    for label, count in sorted(self.skipped.items())
+                )
+            )
+
+        # Signals are not sent for bulk inserts: counters, media references
+        # and timelines are rebuilt once for the whole import instead.
+        started = time.monotonic()
+        self.reset_sequences()
+        call_command('recount_stats', stdout=self.stdout)
+        if timeline.is_enabled():
+            call_command('rebuild_timelines', stdout=self.stdout)
+        cache.bump('global')
+        self.stdout.write(
+            f'Maintenance: {time.monotonic() - started:.1f} s'
+        )
+
+    def load_all(self):
+        for number, level in enumerate(LEVELS):
+            self.load(level, count_skipped=number == 0)
+
+    def load(self, models, count_skipped):
+        labels = {model._meta.label_lower for model in models}
+        known = DERIVED | {model._meta.label_lower for model in MODELS}
+
+        def selected(records):
+            for record in records:
+                label = record.get('model', '').lower()
+                if label in labels:
+                    yield record
+                elif count_skipped and label not in known:
+                    self.skipped[label] += 1
+
+        batches = {model: [] for model in models}
+        try:
+            for obj in python.Deserializer(
+                selected(read_records(self.path)), ignorenonexistent=True
+            ):
+                batch = batches[type(obj.object)]
+                batch.append(obj)
+                if len(batch) == self.batch_size:
+                    self.flush(batch)
+                    batch.clear()
+        except (base.DeserializationError, json.JSONDecodeError) as error:
+            raise CommandError(f'Cannot read {self.path}: {error}')
+        for batch in batches.values():
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        model = type(batch[0].object)
+        objects = [obj.object for obj in batch]
+        started = time.monotonic()
+        with transaction.atomic(), dates_kept(model):
+            model.objects.bulk_create(
+                objects, ignore_conflicts=self.skip_existing
+            )
+            for field in model._meta.many_to_many:
+                through = field.remote_field.through
+                source = f'{field.m2m_field_name()}_id'
+                target = f'{field.m2m_reverse_field_name()}_id'
+                through.objects.bulk_create(
+                    [through(**{source: obj.object.pk, target: value})
+                     for obj in batch
+                     for value in obj.m2m_data.get(field.name, ())],
+                    ignore_conflicts=True,
+                )
+        cache.bump(*self.scopes(model, objects))
+        self.counts[model] += len(objects)
+        if self.verbosity >= 2:
+            rate = len(objects) / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f'{model._meta.label}: {self.counts[model]} '
+                f'({rate:.0f} rows/s)'
+            )
+
+    def scopes(self, model, objects):
+        """Cache scopes the signal handlers would have bumped."""
+        if model is User:
+            return {f'author:{user.username}' for user in objects}
+        if model is Group:
+            return {f'group:{group.slug}' for group in objects}
+        if model is Follow:
+            users = {follow.user_id for follow in objects}
+            users.update(follow.author_id for follow in objects)
+            return {
+                f'author:{username}' for username in User.objects.filter(
+                    pk__in=users
+                ).values_list('username', flat=True)
+            }
+        post_ids = {
+            obj.pk if model is Post else obj.post_id for obj in objects
+        }
+        posts = Post.objects.filter(pk__in=post_ids).select_related(
+            'author', 'group'
+        ).only('author__username', 'group__slug')
+        return set().union(*(cache.post_scopes(post) for post in posts))
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(no_style(), MODELS)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
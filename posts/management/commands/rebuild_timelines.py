@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+from posts.models import Follow, TimelineEntry
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает материализованные ленты подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trim-only',
+            action='store_true',
+            help='Только обрезать ленты до TIMELINE_MAX_LENGTH записей',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(
+            follower__isnull=False
+        ).distinct().values_list('pk', flat=True)
+        rebuilt = trimmed = 0
+        for user_id in users.iterator():
+            with transaction.atomic():
+                if not options['trim_only']:
+                    TimelineEntry.objects.filter(user_id=user_id).delete()
+                    authors = Follow.objects.filter(
+                        user_id=user_id
+                    ).values_list('author_id', flat=True)
+                    for author_id in authors:
+                        timeline.backfill(user_id, author_id)
+                trimmed += timeline.trim(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Timelines: {rebuilt}, trimmed entries: {trimmed}'
+        ))
@@ -0,0 +1,113 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Follow, MediaFile, Post, UserStats
+
+User = get_user_model()
+
+BATCH_SIZE = 500
+
+
+def count_by(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики записей, подписок, комментариев '
+        'и ссылок на картинки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать количество рассинхронизированных счётчиков',
+        )
+
+    def handle(self, *args, **options):
+        missing = User.objects.filter(stats__isnull=True)
+        if options['dry_run']:
+            self.stdout.write(
+                f'Missing: {missing.count()}, '
+                f'out of sync: {self.stale_stats().count()}, '
+                f'posts out of sync: {self.stale_posts().count()}, '
+                f'media out of sync: {self.stale_media().count()}'
+            )
+            return
+
+        with transaction.atomic():
+            created = UserStats.objects.bulk_create(
+                [UserStats(user_id=pk)
+                 for pk in missing.values_list('pk', flat=True)],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            repaired = self.repair(
+                self.stale_stats(),
+                posts_count=count_by(Post, 'author'),
+                followers_count=count_by(Follow, 'author'),
+                following_count=count_by(Follow, 'user'),
+            )
+            repaired_posts = self.repair(
+                self.stale_posts(),
+                comment_count=count_by(Comment, 'post'),
+            )
+            # Raw saves (loaddata, bulk imports) skip the storage's
+            # reference counting, so images can be missing from MediaFile.
+            MediaFile.objects.bulk_create(
+                (MediaFile(name=name)
+                 for name in self.unregistered_images().iterator()),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            repaired_media = self.repair(
+                self.stale_media(),
+                references=count_by(Post, 'image'),
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Created: {len(created)}, repaired: {repaired}, '
+            f'posts repaired: {repaired_posts}, '
+            f'media repaired: {repaired_media}'
+        ))
+
+    def repair(self, stale, **counters):
+        pks = list(stale.values_list('pk', flat=True))
+        for start in range(0, len(pks), BATCH_SIZE):
+            stale.model.objects.filter(
+                pk__in=pks[start:start + BATCH_SIZE]
+            ).update(**counters)
+        return len(pks)
+
+    def stale_stats(self):
+        return UserStats.objects.annotate(
+            actual_posts=count_by(Post, 'author'),
+            actual_followers=count_by(Follow, 'author'),
+            actual_following=count_by(Follow, 'user'),
+        ).exclude(
+            posts_count=F('actual_posts'),
+            followers_count=F('actual_followers'),
+            following_count=F('actual_following'),
+        )
+
+    def stale_posts(self):
+        return Post.objects.annotate(
+            actual_comments=count_by(Comment, 'post')
+        ).exclude(comment_count=F('actual_comments'))
+
+    def unregistered_images(self):
+        return Post.objects.exclude(image='').exclude(image=None).exclude(
+            image__in=MediaFile.objects.values('name')
+        ).order_by().values_list('image', flat=True).distinct()
+
+    def stale_media(self):
+        return MediaFile.objects.annotate(
+            actual_references=count_by(Post, 'image')
+        ).exclude(references=F('actual_references'))
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетических пользователей, группы, записи, комментарии '
+        'и подписки с распределением активности по закону Ципфа'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=50,
+            help='Сколько авторов выбирает каждый пользователь '
+                 '(повторы отбрасываются)',
+        )
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument(
+            '--images',
+            type=int,
+            default=0,
+            help='Сколько записей получат картинку',
+        )
+        parser.add_argument(
+            '--zipf',
+            type=float,
+            default=1.1,
+            help='Показатель степени закона Ципфа: чем больше, '
+                 'тем сильнее активность сосредоточена у немногих',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='За сколько последних дней распределить даты записей '
+                 'и комментариев',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='seed',
+            help='Префикс имён пользователей и адресов групп',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора случайных чисел',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            seeding.seed(
+                users=options['users'],
+                posts=options['posts'],
+                comments=options['comments'],
+                follows=options['follows'],
+                groups=options['groups'],
+                images=options['images'],
+                exponent=options['zipf'],
+                days=options['days'],
+                prefix=options['prefix'],
+                rng=random.Random(options['seed']),
+                stdout=self.stdout,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded in {time.monotonic() - started:.1f} s'
+        ))
@@ -0,0 +1,44 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заранее генерирует миниатюры картинок из записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Количество процессов (по умолчанию — по числу ядер)',
+        )
+
+    def handle(self, *args, **options):
+        names = list(
+            Post.objects.exclude(image='').exclude(image=None).order_by()
+            .values_list('image', flat=True).distinct()
+        )
+        workers = max(1, min(options['workers'], len(names)))
+        if workers == 1:
+            done = [thumbnails.generate(name) for name in names]
+        else:
+            # Forked workers must not share the parent's DB connections.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('fork'),
+            ) as executor:
+                done = list(executor.map(
+                    thumbnails.generate, names,
+                    chunksize=max(1, len(names) // (workers * 4)),
+                ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Images: {len(done)}, workers: {workers}'
+        ))
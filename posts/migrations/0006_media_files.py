@@ -0,0 +1,44 @@
+# Generated by Django 3.2.4 on 2026-10-18 02:35
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def fill_media_files(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    MediaFile = apps.get_model('posts', 'MediaFile')
+    images = Post.objects.exclude(image='').exclude(image=None).order_by(
+    ).values('image').annotate(references=Count('pk'))
+    MediaFile.objects.bulk_create(
+        (MediaFile(name=row['image'], references=row['references'])
+         for row in images.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Путь к файлу')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Фотография'),
+        ),
+        migrations.RunPython(fill_media_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+from posts.operations import AddSearchIndex
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0006_media_files'),
+    ]
+
+    operations = [
+        AddSearchIndex(),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.4 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+from posts.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0007_post_search'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['-created'], name='posts_comment_created'),
+        ),
+    ]
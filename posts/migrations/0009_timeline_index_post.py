@@ -0,0 +1,25 @@
+# Generated by Django 3.2.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+from posts.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0008_comment_created_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='posts_timeline_user_date_post'),
+        ),
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='posts_timeline_user_date',
+        ),
+    ]
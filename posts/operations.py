@@ -0,0 +1,111 @@
+from django.db.migrations import AddIndex
+from django.db.migrations.operations.base import Operation
+
+
+class AddIndexConcurrently(AddIndex):
+    """
+    ``CREATE INDEX CONCURRENTLY`` on PostgreSQL, so building an index does
+    not lock the table against writes; a regular ``AddIndex`` elsewhere.
+
+    Migrations using it must set ``atomic = False``.
+    """
+
+    def describe(self):
+        return 'Concurrently create index %s on field(s) %s of model %s' % (
+            self.index.name,
+            ', '.join(self.index.fields),
+            self.model_name,
+        )
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class AddSearchIndex(Operation):
+    """
+    Full-text index over ``posts_post.text``, maintained by the database
+    on every write: a generated ``tsvector`` column with a GIN index on
+    PostgreSQL, an external-content FTS5 table with triggers on SQLite.
+    See ``posts/search.py`` for the queries.
+
+    The model does not know about either, so on SQLite any later migration
+    that rebuilds ``posts_post`` drops the triggers and has to run this
+    operation again. On PostgreSQL the migration must set ``atomic = False``.
+    """
+    reduces_to_sql = False
+    reversible = True
+
+    sql = {
+        'postgresql': [
+            "ALTER TABLE posts_post ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS "
+            "(to_tsvector('russian', coalesce(text, ''))) STORED",
+            'CREATE INDEX CONCURRENTLY posts_post_search '
+            'ON posts_post USING GIN (search_vector)',
+        ],
+        'sqlite': [
+            "CREATE VIRTUAL TABLE posts_post_fts USING fts5(text, "
+            "content='posts_post', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')",
+            'CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post '
+            'BEGIN INSERT INTO posts_post_fts(rowid, text) '
+            'VALUES (new.id, new.text); END',
+            'CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post '
+            "BEGIN INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+            "VALUES ('delete', old.id, old.text); END",
+            'CREATE TRIGGER posts_post_fts_update '
+            'AFTER UPDATE OF text ON posts_post '
+            "BEGIN INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+            "VALUES ('delete', old.id, old.text); "
+            'INSERT INTO posts_post_fts(rowid, text) '
+            'VALUES (new.id, new.text); END',
+            "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')",
+        ],
+    }
+    reverse_sql = {
+        'postgresql': [
+            'DROP INDEX CONCURRENTLY IF EXISTS posts_post_search',
+            'ALTER TABLE posts_post DROP COLUMN IF EXISTS search_vector',
+        ],
+        'sqlite': [
+            'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+            'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+            'DROP TRIGGER IF EXISTS posts_post_fts_update',
+            'DROP TABLE IF EXISTS posts_post_fts',
+        ],
+    }
+
+    def describe(self):
+        return 'Create full-text search index on posts_post.text'
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def run(self, schema_editor, statements):
+        for statement in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(statement, params=None)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        self.run(schema_editor, self.sql)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        self.run(schema_editor, self.reverse_sql)
@@ -0,0 +1,223 @@
+import base64
+import binascii
+import math
+from collections.abc import Sequence
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+# Largest value of a bigint primary key.
+MAX_PK = 2 ** 63 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def counted_paginator(object_list, per_page, count):
+    """
+    ``Paginator`` whose total comes from ``count`` (a number or a callable)
+    instead of ``SELECT COUNT(*)`` over ``object_list``.
+    """
+    paginator = Paginator(object_list, per_page)
+    # Paginator.count is a cached_property: seeding it skips the query.
+    paginator.count = count() if callable(count) else count
+    return paginator
+
+
+def estimate_count(model):
+    """Planner's row estimate for a whole table (PostgreSQL only)."""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    ``Paginator`` for admin changelists: an unfiltered table past
+    ``POSTS_COUNT_ESTIMATE_THRESHOLD`` rows is counted from the planner's
+    estimate instead of ``SELECT COUNT(*)``.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimate_count(queryset.model)
+            if estimate is not None and \
+                    estimate >= settings.POSTS_COUNT_ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = repr(float(value))
+    raw = f'{value}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, value_type=datetime):
+    """
+    ``(value, pk)`` of a cursor whose value is a ``value_type``: an aware
+    datetime or a finite float. Anything else, including a pk that no
+    database column can hold, raises ``InvalidCursor``.
+    """
+    try:
+        padding = '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(token + padding).decode()
+        value, pk = raw.rsplit('|', 1)
+        if value_type is datetime:
+            value = parse_datetime(value)
+            if value is None or value.tzinfo is None:
+                raise ValueError(value)
+        else:
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError(value)
+        pk = int(pk)
+        if not 1 <= pk <= MAX_PK:
+            raise ValueError(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    return value, pk
+
+
+class CursorPage(Sequence):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class CursorPaginator:
+    """Keyset pagination over ``(field, pk)`` in descending order.
+
+    Unlike ``Paginator`` it never runs ``COUNT(*)`` or ``OFFSET``: every page
+    is a single indexed range scan starting right after the cursor, so pages
+    stay stable when new rows are inserted at the head of the feed.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, field='pub_date',
+                 value_type=datetime):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.field = field
+        self.value_type = value_type
+
+    def cursor_for(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
+
+    def _older_than(self, value, pk):
+        return (
+            Q(**{f'{self.field}__lt': value})
+            | Q(**{self.field: value, 'pk__lt': pk})
+        )
+
+    def _newer_than(self, value, pk):
+        return (
+            Q(**{f'{self.field}__gt': value})
+            | Q(**{self.field: value, 'pk__gt': pk})
+        )
+
+    def window(self, older_than=None, newer_than=None):
+        """
+        Up to ``per_page + 1`` rows past the ``(value, pk)`` cursor: newest
+        first, or oldest first past a ``newer_than`` cursor.
+        """
+        queryset = self.object_list
+        if newer_than is not None:
+            queryset = queryset.filter(self._newer_than(*newer_than))
+            queryset = queryset.order_by(self.field, 'pk')
+        else:
+            if older_than is not None:
+                queryset = queryset.filter(self._older_than(*older_than))
+            queryset = queryset.order_by(f'-{self.field}', '-pk')
+        return list(queryset[:self.per_page + 1])
+
+    def first_page(self):
+        items = self.window()
+        return CursorPage(
+            items[:self.per_page], self, len(items) > self.per_page, False
+        )
+
+    def page_after(self, token):
+        items = self.window(
+            older_than=decode_cursor(token, self.value_type)
+        )
+        return CursorPage(
+            items[:self.per_page], self, len(items) > self.per_page, True
+        )
+
+    def page_before(self, token):
+        items = self.window(
+            newer_than=decode_cursor(token, self.value_type)
+        )
+        if not items:
+            return self.first_page()
+        has_previous = len(items) > self.per_page
+        items = items[:self.per_page]
+        items.reverse()
+        return CursorPage(items, self, True, has_previous)
+
+    def get_page(self, after=None, before=None):
+        """
+        Return a valid page even if the cursor is malformed,
+        mirroring ``Paginator.get_page``.
+        """
+        try:
+            if after:
+                return self.page_after(after)
+            if before:
+                return self.page_before(before)
+        except InvalidCursor:
+            pass
+        return self.first_page()
@@ -0,0 +1,209 @@
+"""Live profiling for staff and a slow query log.
+
+A staff user adds ``?profile=sample`` (or the ``X-Profile: sample``
+header) to any URL to get the request's stacks sampled every
+``POSTS_PROFILER_INTERVAL_MS`` in the collapsed format that
+``flamegraph.pl`` and speedscope read; ``profile=cprofile`` returns a
+cProfile report instead. The page itself is rendered, bypassing the page
+cache, but not returned.
+
+``SlowQueryMiddleware`` logs every query slower than
+``POSTS_SLOW_QUERY_MS`` to ``posts.slow_queries`` together with its plan
+and the view that ran it. Query parameters may hold session keys or
+whatever users typed, so they are only logged with
+``POSTS_SLOW_QUERY_PARAMS`` and masked in the plan otherwise.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.utils.cache import add_never_cache_headers
+
+logger = logging.getLogger('posts.slow_queries')
+
+PROFILE_PARAMETER = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+REPORT_LINES = 60
+EXPLAINABLE = ('SELECT', 'WITH')
+
+
+def frame_label(code):
+    """``function (file:line)`` with the path shortened for reading."""
+    path = code.co_filename
+    if 'site-packages' + os.sep in path:
+        path = path.split('site-packages' + os.sep, 1)[1]
+    elif path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the thread that entered it from a helper thread,
+    so the profiled code runs at full speed between samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.sampler.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(
+            f'{stack} {count}\n'
+            for stack, count in self.stacks.most_common()
+        )
+
+
+def run_sampled(get_response, request):
+    interval = settings.POSTS_PROFILER_INTERVAL_MS / 1000
+    with SamplingProfiler(interval) as profiler:
+        response = get_response(request)
+    return response, profiler.collapsed()
+
+
+def run_cprofile(get_response, request):
+    profiler = cProfile.Profile()
+    response = profiler.runcall(get_response, request)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats(
+        'cumulative'
+    ).print_stats(REPORT_LINES)
+    return response, report.getvalue()
+
+
+PROFILERS = {
+    'sample': run_sampled,
+    'cprofile': run_cprofile,
+}
+
+
+class ProfilingMiddleware:
+    """Goes after ``AuthenticationMiddleware``: only staff may profile."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.GET.get(PROFILE_PARAMETER) or request.META.get(
+            PROFILE_HEADER
+        )
+        user = request.user
+        if mode not in PROFILERS or not (user.is_active and user.is_staff):
+            return self.get_response(request)
+
+        # Checked by cache_versioned: a cached page has nothing to profile.
+        request.profiling = mode
+        page, report = PROFILERS[mode](self.get_response, request)
+        response = HttpResponse(report, content_type='text/plain')
+        response['X-Profiled-Status'] = page.status_code
+        add_never_cache_headers(response)
+        return response
+
+
+class SlowQueries:
+    """``connection.execute_wrapper()`` hook keeping the slow queries."""
+
+    def __init__(self, threshold_ms):
+        self.threshold_ms = threshold_ms
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if duration_ms >= self.threshold_ms:
+                self.queries.append((sql, params, many, duration_ms))
+
+
+def explain(sql, params):
+    """Plan of a read query, or why there is none."""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # A savepoint keeps a failed EXPLAIN from breaking the
+        # surrounding transaction on PostgreSQL.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'{connection.ops.explain_query_prefix()} {sql}', params
+            )
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def redact(plan, params):
+    """``plan`` with the string parameters of its query masked."""
+    for param in params or ():
+        if isinstance(param, str) and param:
+            quoted = "'{}'".format(param.replace("'", "''"))
+            plan = plan.replace(quoted, "'?'")
+    return plan
+
+
+class SlowQueryMiddleware:
+    """
+    Plans are taken after the response is ready, outside the wrapper, so
+    the EXPLAIN queries neither count nor recurse.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold_ms = settings.POSTS_SLOW_QUERY_MS
+        if not threshold_ms:
+            return self.get_response(request)
+
+        slow = SlowQueries(threshold_ms)
+        with connection.execute_wrapper(slow):
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        log_params = settings.POSTS_SLOW_QUERY_PARAMS
+        for sql, params, many, duration_ms in slow.queries:
+            plan = None if many else explain(sql, params)
+            if plan and not log_params:
+                plan = redact(plan, params)
+            logger.warning(json.dumps({
+                'view': match.view_name if match else None,
+                'path': request.path,
+                'duration_ms': round(duration_ms, 1),
+                'sql': sql,
+                'params': [str(p) for p in params or ()]
+                if log_params and not many else None,
+                'plan': plan,
+            }, ensure_ascii=False))
+        return response
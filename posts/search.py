@@ -0,0 +1,90 @@
+"""Full-text search over posts.
+
+The index lives outside the ORM (see ``AddSearchIndex``): a generated
+``search_vector`` column with a GIN index on PostgreSQL and the
+``posts_post_fts`` FTS5 table on SQLite, so queries are built from raw
+SQL fragments for the current backend. Matches are ranked with
+``ts_rank`` or ``bm25``; ``rank`` is always "higher is better", which lets
+``CursorPaginator`` page through results with a ``(rank, pk)`` cursor.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+QUERY_MAX_LENGTH = 200
+
+TSQUERY = "websearch_to_tsquery('russian', %s)"
+
+# Highlight markers that cannot appear in escaped HTML.
+START_SELECTION = '\x02'
+STOP_SELECTION = '\x03'
+
+
+def to_fts5(query):
+    """Quote every word, so user input is never parsed as FTS5 syntax."""
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', query))
+
+
+def search_posts(query):
+    """Posts matching ``query``, annotated with ``rank``."""
+    if connection.vendor == 'postgresql':
+        return Post.objects.feed().extra(
+            where=[f'posts_post.search_vector @@ {TSQUERY}'], params=[query]
+        ).annotate(rank=RawSQL(
+            f'ts_rank(posts_post.search_vector, {TSQUERY})', [query],
+            output_field=FloatField()
+        ))
+
+    match = to_fts5(query)
+    if not match:
+        return Post.objects.none().annotate(
+            rank=Value(0.0, output_field=FloatField())
+        )
+    return Post.objects.feed().extra(
+        where=['posts_post.id IN (SELECT rowid FROM posts_post_fts '
+               'WHERE posts_post_fts MATCH %s)'],
+        params=[match]
+    ).annotate(rank=RawSQL(
+        '(SELECT -bm25(posts_post_fts) FROM posts_post_fts '
+        'WHERE posts_post_fts MATCH %s AND rowid = posts_post.id)', [match],
+        output_field=FloatField()
+    ))
+
+
+def headline_expression(query):
+    if connection.vendor == 'postgresql':
+        return RawSQL(
+            f"ts_headline('russian', posts_post.text, {TSQUERY}, %s)",
+            [query, f'StartSel={START_SELECTION}, StopSel={STOP_SELECTION}, '
+                    'HighlightAll=true']
+        )
+    return RawSQL(
+        '(SELECT highlight(posts_post_fts, 0, %s, %s) FROM posts_post_fts '
+        'WHERE posts_post_fts MATCH %s AND rowid = posts_post.id)',
+        [START_SELECTION, STOP_SELECTION, to_fts5(query)]
+    )
+
+
+def highlight(posts, query):
+    """
+    Set ``post.headline``: the escaped text with matches wrapped in
+    ``<mark>``. Headlines are built in one query for the given posts only.
+    """
+    headlines = dict(Post.objects.filter(
+        pk__in=[post.pk for post in posts]
+    ).annotate(
+        headline=headline_expression(query)
+    ).values_list('pk', 'headline'))
+    for post in posts:
+        headline = escape(headlines.get(post.pk) or post.text)
+        post.headline = mark_safe(
+            headline.replace(START_SELECTION, '<mark>')
+            .replace(STOP_SELECTION, '</mark>')
+        )
+    return posts
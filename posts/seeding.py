@@ -0,0 +1,165 @@
+"""Synthetic social graph for load tests, benchmarks and plan checks.
+
+Activity is Zipf-distributed, like on a real site: a few authors write
+most posts and have most followers, a few posts get most comments.
+"""
+import io
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.utils import timezone
+from PIL import Image
+
+from . import cache, timeline
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+WORDS = (
+    'кот', 'собака', 'город', 'река', 'лес', 'книга', 'музыка', 'утро',
+    'вечер', 'дорога', 'море', 'письмо', 'сад', 'дождь', 'снег', 'поезд',
+    'дом', 'окно', 'чай', 'друг', 'работа', 'отпуск', 'кино', 'звезда',
+)
+IMAGE_SIZE = (96, 64)
+
+
+def zipf_choices(rng, population, k, exponent):
+    """``k`` items of ``population``, the n-th drawn with weight n^-s."""
+    if not population:
+        return []
+    weights = accumulate(
+        rank ** -exponent for rank in range(1, len(population) + 1)
+    )
+    return rng.choices(population, cum_weights=list(weights), k=k)
+
+
+def random_text(rng, min_words=5, max_words=40):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def random_image(rng):
+    """A small noise JPEG; noise keeps content-addressed files distinct."""
+    size = IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3
+    image = Image.frombytes(
+        'RGB', IMAGE_SIZE, rng.getrandbits(size * 8).to_bytes(size, 'big')
+    )
+    output = io.BytesIO()
+    image.save(output, 'JPEG')
+    return ContentFile(output.getvalue())
+
+
+def save_images(rng, count):
+    field = Post._meta.get_field('image')
+    return [
+        field.storage.save(
+            f'{field.upload_to}seed.jpg', random_image(rng)
+        )
+        for _ in range(count)
+    ]
+
+
+def set_dates(model, field, dates):
+    """Bulk update ``field`` of ``model`` rows from ``{pk: date}``."""
+    model.objects.bulk_update(
+        [model(pk=pk, **{field: date}) for pk, date in dates.items()],
+        [field],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def seed(users, posts, comments=0, follows=0, groups=0, images=0,
+         exponent=1.1, days=365, prefix='seed', rng=None, stdout=None):
+    """
+    Create ``users`` accounts and the given numbers of posts, comments
+    and groups; every user follows up to ``follows`` authors and
+    ``images`` posts get a picture. Posts and comments are dated over
+    the last ``days`` days. Derived data (counters, timelines) is rebuilt
+    once at the end, as after ``import_data``.
+    """
+    rng = rng or random.Random(0)
+    password = make_password(None)
+    User.objects.bulk_create(
+        (User(username=f'{prefix}_user_{i}', password=password)
+         for i in range(users)),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    Group.objects.bulk_create(
+        (Group(title=f'Группа {i}', slug=f'{prefix}-group-{i}',
+               description=random_text(rng))
+         for i in range(groups)),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    # bulk_create() does not return primary keys on every backend,
+    # so related rows are built from ids fetched back by prefix.
+    user_ids = list(User.objects.filter(
+        username__startswith=f'{prefix}_user_'
+    ).order_by('pk').values_list('pk', flat=True))
+    group_ids = list(Group.objects.filter(
+        slug__startswith=f'{prefix}-group-'
+    ).values_list('pk', flat=True))
+    # Popularity ranks are shuffled so that they do not follow the ids.
+    authors = rng.sample(user_ids, len(user_ids))
+
+    image_names = save_images(rng, min(images, posts))
+    image_names += [''] * (posts - len(image_names))
+    rng.shuffle(image_names)
+    Post.objects.bulk_create(
+        (Post(author_id=author_id,
+              group_id=rng.choice(group_ids + [None]),
+              text=random_text(rng),
+              image=image)
+         for author_id, image in zip(
+             zipf_choices(rng, authors, posts, exponent), image_names
+         )),
+        batch_size=BATCH_SIZE,
+    )
+
+    post_ids = list(Post.objects.filter(
+        author__username__startswith=f'{prefix}_user_'
+    ).order_by('pk').values_list('pk', flat=True))
+    # auto_now_add stamps a whole bulk insert with the same moment, which
+    # no real feed looks like: posts are spread over the last ``days``
+    # days in the order of their ids, comments come after their post.
+    now = timezone.now()
+    span = timedelta(days=days).total_seconds()
+    offsets = sorted(rng.uniform(0, span) for _ in post_ids)
+    pub_dates = {
+        pk: now - timedelta(seconds=span - offset)
+        for pk, offset in zip(post_ids, offsets)
+    }
+    set_dates(Post, 'pub_date', pub_dates)
+    rng.shuffle(post_ids)
+    Comment.objects.bulk_create(
+        (Comment(post_id=post_id, author_id=rng.choice(user_ids),
+                 text=random_text(rng, 1, 15))
+         for post_id in zipf_choices(rng, post_ids, comments, exponent)),
+        batch_size=BATCH_SIZE,
+    )
+    set_dates(Comment, 'created', {
+        pk: pub_dates[post_id] + rng.random() * (now - pub_dates[post_id])
+        for pk, post_id in Comment.objects.filter(
+            post__author__username__startswith=f'{prefix}_user_',
+            created__gte=now,
+        ).values_list('pk', 'post_id')
+    })
+    Follow.objects.bulk_create(
+        (Follow(user_id=user_id, author_id=author_id)
+         for user_id in user_ids
+         for author_id in set(zipf_choices(rng, authors, follows, exponent))
+         if author_id != user_id),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    call_command('recount_stats', stdout=stdout or io.StringIO())
+    if timeline.is_enabled():
+        call_command('rebuild_timelines', stdout=stdout or io.StringIO())
+    cache.bump('global')
@@ -0,0 +1,107 @@
+"""Content-addressed storage for post images.
+
+Files are named by the SHA-256 of their content and sharded into two
+levels of directories under the field's ``upload_to``, e.g.
+``posts/3f/a2/3fa2…c9.jpg``, so no directory grows past a few thousand
+entries. Saving content that is already stored only adds a reference in
+``MediaFile``; ``delete()`` drops one and removes the file with its
+thumbnails once the last reference is gone and the transaction has
+committed.
+"""
+import hashlib
+import logging
+import os
+
+from django.apps import apps
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+def hash_content(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_media_file_model(self):
+        # Imported lazily: models.py needs this module for Post.image.
+        return apps.get_model('posts', 'MediaFile')
+
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = hash_content(content)
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if not self.exists(name):
+            name = self._save(name, content)
+        name = name.replace('\\', '/')
+        self.add_reference(name)
+        return name
+
+    def add_reference(self, name):
+        MediaFile = self.get_media_file_model()
+        references = MediaFile.objects.filter(name=name)
+        if references.update(references=F('references') + 1):
+            return
+        try:
+            with transaction.atomic():
+                MediaFile.objects.create(name=name, references=1)
+        except IntegrityError:
+            references.update(references=F('references') + 1)
+
+    def delete(self, name):
+        """Drop one reference; remove the file after the last one."""
+        MediaFile = self.get_media_file_model()
+        with transaction.atomic():
+            entry = MediaFile.objects.select_for_update().filter(
+                name=name
+            ).first()
+            if entry is not None and entry.references > 1:
+                entry.references = F('references') - 1
+                entry.save(update_fields=['references'])
+                return
+            if entry is not None:
+                entry.delete()
+        # Files saved before this storage have no entry and one owner.
+        transaction.on_commit(lambda: self.delete_file(name))
+
+    def delete_file(self, name):
+        """Remove the file and its thumbnails once nothing refers to it."""
+        # Imported lazily, like the model: thumbnails needs Post.
+        from .thumbnails import delete_thumbnails
+        MediaFile = self.get_media_file_model()
+        try:
+            with transaction.atomic():
+                # The same content may have been saved again since the
+                # last reference was dropped.
+                if MediaFile.objects.select_for_update().filter(
+                    name=name
+                ).exists():
+                    return
+                delete_thumbnails(name)
+                super().delete(name)
+        except (OSError, SuspiciousFileOperation):
+            # The reference is gone already: leave the file as an orphan.
+            logger.warning('Could not delete media file %s', name,
+                           exc_info=True)
@@ -1,14 +1,42 @@
+import base64
+import csv
+import gzip
 import io
+import json
+import os
 import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.db import connection
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.files.uploadhandler import StopUpload
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from PIL import Image
-
-from posts.models import Comment, Follow, Group, Post
+from sorl.thumbnail import get_thumbnail
+
+from posts import thumbnails, timeline
+from posts.budgets import BudgetExceeded, budget, within_budget
+from posts.cache import LOCK_KEY, get_or_compute, get_versions, is_fresh
+from posts.images import LimitedUploadHandler
+from posts.models import (Comment, Follow, Group, MediaFile, Post,
+                          TimelineEntry, UserStats)
+from posts.pagination import encode_cursor
+from posts.profiling import SamplingProfiler, redact
+from posts.search import search_posts
+from posts.views import POSTS_PER_PAGE
 
 User = get_user_model()
 
@@ -278,24 +306,15 @@ class PostsTest(TestCase):
         self.assertEqual(response.status_code, 404)
 
     def test_cached_index_page(self):
+        self.create_new_post(text='first_text', commit=True)
+        response1 = self.client.get(reverse('index'))
+        response2 = self.client.get(reverse('index'))
+        self.assertEqual(response1.content, response2.content)
 
-        def create_and_get_response(no_cache=False):
-            self.create_new_post(text='test_text', commit=True)
-            if no_cache:
-                cache.clear()
-            return self.client.get(reverse('index'))
-
-        def compare_responses(no_cache):
-            response1 = create_and_get_response(no_cache)
-            response2 = create_and_get_response(no_cache)
-
-            if not no_cache:
-                self.assertEqual(response1.content, response2.content)
-            else:
-                self.assertNotEqual(response1.content, response2.content)
-
-        compare_responses(no_cache=False)
-        compare_responses(no_cache=True)
+        self.create_new_post(text='second_text', commit=True)
+        response3 = self.client.get(reverse('index'))
+        self.assertNotEqual(response1.content, response3.content)
+        self.assertContains(response3, 'second_text')
 
     def follow_to_user(self, author, user=None, directly_db=None):
         if user is None:
@@ -413,6 +432,1620 @@ class PostsTest(TestCase):
         self.assertEqual(comment, None)
 
 
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='cursor_user')
+        self.posts = [
+            Post.objects.create(author=self.user, text=f'post {i}')
+            for i in range(25)
+        ]
+        self.expected = sorted(
+            self.posts, key=lambda post: (post.pub_date, post.pk),
+            reverse=True
+        )
+        cache.clear()
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('index'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page']
+
+    def test_walk_forward_and_back(self):
+        page = self.get_page(after='first')
+        seen = list(page)
+        while page.has_next():
+            page = self.get_page(after=page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, self.expected)
+
+        page = self.get_page(before=page.previous_cursor)
+        self.assertEqual(list(page), self.expected[10:20])
+
+    def test_stable_under_inserts(self):
+        page = self.get_page(after='first')
+        Post.objects.create(author=self.user, text='new post')
+        page = self.get_page(after=page.next_cursor)
+        self.assertEqual(list(page), self.expected[10:20])
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = self.get_page(after='not-a-cursor')
+        self.assertEqual(list(page), self.expected[:10])
+        self.assertFalse(page.has_previous())
+
+    def test_malformed_cursors_fall_back_to_first_page(self):
+        newest = self.expected[0]
+        tokens = {
+            'float value': '1.5|1',
+            'naive datetime': '2020-01-01T00:00:00|1',
+            'nan': 'nan|1',
+            'inf': 'inf|1',
+            'overflowing float': '1e400|1',
+            'zero pk': f'{newest.pub_date.isoformat()}|0',
+            'huge pk': f'{newest.pub_date.isoformat()}|{2 ** 64}',
+        }
+        for case, raw in tokens.items():
+            token = base64.urlsafe_b64encode(raw.encode()).decode()
+            for direction in ('after', 'before'):
+                with self.subTest(case=case, direction=direction):
+                    page = self.get_page(**{direction: token})
+                    self.assertEqual(list(page), self.expected[:10])
+
+    def test_page_mode_is_kept(self):
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertEqual(
+            list(response.context['page']), self.expected[10:20]
+        )
+
+    def test_numbered_page_links_into_cursor_mode(self):
+        response = self.client.get(reverse('index'), {'page': 2})
+        cursor = response.context['page'].next_cursor
+        self.assertContains(response, f'href="?after={cursor}"')
+        self.assertEqual(
+            list(self.get_page(after=cursor)), self.expected[20:]
+        )
+
+        response = self.client.get(reverse('index'), {'page': 3})
+        self.assertNotContains(response, '?after=')
+
+
+class FeedQueryCountTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='feed_author')
+        self.reader = User.objects.create_user(username='feed_reader')
+        self.group = Group.objects.create(
+            title='feed_group', slug='feed_group', description='test'
+        )
+        for i in range(12):
+            post = Post.objects.create(
+                author=self.author, group=self.group, text=f'post {i}'
+            )
+            Comment.objects.create(
+                post=post, author=self.reader, text='comment'
+            )
+        self.lonely_post = Post.objects.create(
+            author=self.author, text='no comments'
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.clear()
+
+    def test_feed_reads_comment_count(self):
+        posts = Post.objects.feed()
+        with self.assertNumQueries(1):
+            counts = [post.comment_count for post in posts]
+        self.assertEqual(counts, [0] + [1] * 12)
+
+    def test_listing_query_counts(self):
+        urls = (
+            (reverse('index'), 2),
+            (reverse('group', kwargs={'slug': self.group.slug}), 3),
+            (reverse('profile',
+                     kwargs={'username': self.author.username}), 2),
+            (reverse('post', kwargs={'username': self.author.username,
+                                     'post_id': self.lonely_post.pk}), 2),
+        )
+        for url, queries in urls:
+            with self.subTest(url=url), self.assertNumQueries(queries):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_follow_index_query_count(self):
+        self.client.force_login(self.reader)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'Добавить комментарий', count=1)
+        self.assertContains(response, '1 комментариев', count=9)
+
+
+class CommentPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='comment_author')
+        self.post = Post.objects.create(author=self.author, text='text')
+        self.commenters = [
+            User.objects.create_user(username=f'commenter_{i}')
+            for i in range(5)
+        ]
+        for i in range(25):
+            Comment.objects.create(
+                post=self.post, author=self.commenters[i % 5],
+                text=f'comment {i}'
+            )
+        self.expected = list(self.post.comments.order_by('-created', '-pk'))
+        self.url = reverse('post', kwargs={'username': self.author.username,
+                                           'post_id': self.post.pk})
+        cache.clear()
+
+    def test_comment_counter(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 25)
+        self.expected[0].delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 24)
+
+    def test_comments_are_paged(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        items = response.context['items']
+        self.assertEqual(list(items), self.expected[:20])
+        self.assertEqual(
+            set(response.context['comments']), set(self.expected[:20])
+        )
+        self.assertContains(response, 'Комментарии: 25')
+        self.assertContains(response, f'?after={items.next_cursor}')
+
+        response = self.client.get(self.url, {'after': items.next_cursor})
+        items = response.context['items']
+        self.assertEqual(list(items), self.expected[20:])
+        self.assertFalse(items.has_next())
+        self.assertContains(response, f'?before={items.previous_cursor}')
+
+    def test_recount_repairs_comment_count(self):
+        Post.objects.filter(pk=self.post.pk).update(comment_count=3)
+        call_command('recount_stats', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 25)
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='search_author')
+        self.best = Post.objects.create(
+            author=self.author, text='кот и кот <b>кот</b>'
+        )
+        self.other = Post.objects.create(
+            author=self.author, text='собака и кот'
+        )
+        Post.objects.create(author=self.author, text='только собака')
+        cache.clear()
+
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params})
+
+    def test_results_are_ranked_and_highlighted(self):
+        response = self.search('кот')
+        self.assertEqual(
+            list(response.context['page']), [self.best, self.other]
+        )
+        self.assertContains(
+            response,
+            '<mark>кот</mark> и <mark>кот</mark> '
+            '&lt;b&gt;<mark>кот</mark>&lt;/b&gt;',
+            html=False
+        )
+
+    def test_index_follows_writes(self):
+        self.other.text = 'собака'
+        self.other.save()
+        self.best.delete()
+        self.assertEqual(list(self.search('кот').context['page']), [])
+        self.assertEqual(
+            len(self.search('собака').context['page']), 2
+        )
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ('"кот', 'кот OR', 'NEAR(кот', '*', '  '):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_cursor_pagination(self):
+        for i in range(POSTS_PER_PAGE):
+            Post.objects.create(author=self.author, text=f'кот номер {i}')
+        page = self.search('кот').context['page']
+        self.assertEqual(len(page), POSTS_PER_PAGE)
+        self.assertEqual(page[0], self.best)
+
+        response = self.search('кот', after=page.next_cursor)
+        rest = list(response.context['page'])
+        self.assertEqual(len(rest), 2)
+        self.assertFalse(set(rest) & set(page))
+        self.assertContains(response, '?q=%D0%BA%D0%BE%D1%82&amp;before=')
+
+    def test_wrong_typed_cursor_falls_back_to_first_page(self):
+        post = self.other
+        token = encode_cursor(post.pub_date, post.pk)
+        response = self.search('кот', after=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context['page']), [self.best, self.other]
+        )
+
+
+class AdminChangelistTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin'
+        )
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(
+            title='admin_group', slug='admin_group', description='test'
+        )
+        self.add_rows(3)
+
+    def add_rows(self, count):
+        offset = Post.objects.count()
+        for i in range(offset, offset + count):
+            author = User.objects.create_user(username=f'admin_author_{i}')
+            post = Post.objects.create(
+                author=author, group=self.group, text=f'запись {i}'
+            )
+            Comment.objects.create(post=post, author=author, text='comment')
+            Follow.objects.create(user=self.admin, author=author)
+
+    def changelist(self, model, **params):
+        url = reverse(f'admin:posts_{model}_changelist')
+        return self.client.get(url, params)
+
+    def count_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.changelist(model).status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for model in ('post', 'comment', 'follow'):
+            with self.subTest(model=model):
+                before = self.count_queries(model)
+                self.add_rows(3)
+                self.assertEqual(self.count_queries(model), before)
+
+    def test_search_by_username_and_text(self):
+        response = self.changelist('post', q='admin_author_1')
+        self.assertEqual(
+            [post.text for post in response.context['cl'].result_list],
+            ['запись 1']
+        )
+        response = self.changelist('post', q='запись')
+        self.assertEqual(response.context['cl'].result_count, 3)
+        response = self.changelist('comment', q='admin_author')
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_date_hierarchy(self):
+        for model in ('post', 'comment'):
+            with self.subTest(model=model):
+                self.assertContains(
+                    self.changelist(model), 'class="toplinks"'
+                )
+
+
+class UserStatsTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='stats_author')
+        self.reader = User.objects.create_user(username='stats_reader')
+
+    def get_stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(author=self.author, text='text')
+        Post.objects.create(author=self.author, text='text')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.get_stats(self.author).posts_count, 2)
+        self.assertEqual(self.get_stats(self.author).followers_count, 1)
+        self.assertEqual(self.get_stats(self.reader).following_count, 1)
+
+        post.delete()
+        follow.delete()
+        stats = self.get_stats(self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertEqual(self.get_stats(self.reader).following_count, 0)
+
+    def test_author_info_uses_counters(self):
+        UserStats.objects.filter(user=self.author).update(
+            posts_count=7, followers_count=5, following_count=3
+        )
+        response = self.client.get(
+            reverse('profile', kwargs={'username': self.author.username})
+        )
+        self.assertContains(response, 'Подписчиков: 5')
+        self.assertContains(response, 'Подписан: 3')
+
+    def test_missing_counters_are_counted_on_view(self):
+        loaded = User.objects.create_user(username='stats_loaded')
+        post = Post.objects.create(author=loaded, text='text')
+        Follow.objects.create(user=self.reader, author=loaded)
+        # As after loaddata or bulk_create, which skip the signals.
+        UserStats.objects.filter(user=loaded).delete()
+
+        response = self.client.get(
+            reverse('profile', kwargs={'username': loaded.username})
+        )
+        self.assertContains(response, 'Подписчиков: 1')
+        stats = self.get_stats(loaded)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count), (1, 1)
+        )
+
+        UserStats.objects.filter(user=loaded).delete()
+        response = self.client.get(reverse(
+            'post', kwargs={'username': loaded.username, 'post_id': post.pk}
+        ))
+        self.assertContains(response, 'Подписчиков: 1')
+
+    def test_recount_repairs_counters(self):
+        Post.objects.create(author=self.author, text='text')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.filter(user=self.author).update(
+            posts_count=10, followers_count=0
+        )
+        UserStats.objects.filter(user=self.reader).delete()
+
+        call_command('recount_stats', stdout=io.StringIO())
+
+        stats = self.get_stats(self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(self.get_stats(self.reader).following_count, 1)
+
+
+@override_settings(
+    TIMELINE_ENABLED=True, TIMELINE_MAX_LENGTH=3, TIMELINE_FANOUT_LIMIT=1
+)
+class TimelineTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.reader = User.objects.create_user(username='timeline_reader')
+        self.author = User.objects.create_user(username='timeline_author')
+        self.client.force_login(self.reader)
+
+    def get_feed(self):
+        response = self.client.get(reverse('follow_index'))
+        return list(response.context['page'])
+
+    def test_new_post_fans_out_to_followers(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='text')
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_follow_backfills_capped_and_unfollow_clears(self):
+        posts = [
+            Post.objects.create(author=self.author, text=f'post {i}')
+            for i in range(5)
+        ]
+        self.client.get(reverse(
+            'profile_follow', kwargs={'username': self.author.username}
+        ))
+        entries = TimelineEntry.objects.filter(user=self.reader)
+        self.assertEqual(
+            sorted(entries.values_list('post_id', flat=True)),
+            [post.pk for post in posts[2:]]
+        )
+
+        self.client.get(reverse(
+            'profile_unfollow', kwargs={'username': self.author.username}
+        ))
+        self.assertFalse(entries.exists())
+        self.assertEqual(self.get_feed(), [])
+
+    def test_popular_author_is_read_on_demand(self):
+        other = User.objects.create_user(username='timeline_other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(author=self.author, text='text')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_pages_merge_timeline_and_popular_authors(self):
+        other = User.objects.create_user(username='timeline_other')
+        small = User.objects.create_user(username='timeline_small')
+        Follow.objects.create(user=other, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=small)
+        posts = [
+            Post.objects.create(author=(self.author, small)[i % 2],
+                                text=f'post {i}')
+            for i in range(7)
+        ]
+        # Fanned out before the author became popular: read only once.
+        TimelineEntry.objects.create(
+            user=self.reader, post=posts[0], pub_date=posts[0].pub_date
+        )
+        newest_first = posts[::-1]
+        feed = timeline.posts_for(self.reader)
+        self.assertEqual(list(feed), newest_first)
+
+        paginator = timeline.TimelinePaginator(
+            timeline.posts_for(self.reader), 3
+        )
+        # Fanned-in authors, the timeline, one query per fanned-in author.
+        with self.assertNumQueries(3):
+            first = paginator.get_page()
+        second = paginator.get_page(after=first.next_cursor)
+        third = paginator.get_page(after=second.next_cursor)
+        self.assertEqual(
+            [*first, *second, *third], newest_first
+        )
+        self.assertFalse(third.has_next())
+        back = paginator.get_page(before=third.previous_cursor)
+        self.assertEqual(list(back), newest_first[3:6])
+
+        numbered = Paginator(feed, 3)
+        self.assertEqual(list(numbered.page(2)), newest_first[3:6])
+
+        response = self.client.get(
+            reverse('follow_index'), {'after': first.next_cursor}
+        )
+        self.assertEqual(list(response.context['page']), newest_first[3:])
+
+    def test_rebuild_timelines(self):
+        Post.objects.create(author=self.author, text='text')
+        with self.settings(TIMELINE_ENABLED=False):
+            Follow.objects.create(user=self.reader, author=self.author)
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+
+
+class VersionedCacheTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='cache_author')
+        self.reader = User.objects.create_user(username='cache_reader')
+        self.group = Group.objects.create(
+            title='cache_group', slug='cache_group', description='test'
+        )
+        self.other_group = Group.objects.create(
+            title='other_group', slug='other_group', description='test'
+        )
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='cached post'
+        )
+        cache.clear()
+
+    def url(self, name, **kwargs):
+        return reverse(name, kwargs=kwargs)
+
+    def test_pages_are_served_from_cache(self):
+        urls = [
+            self.url('index'),
+            self.url('group', slug=self.group.slug),
+            self.url('profile', username=self.author.username),
+            self.url('post', username=self.author.username,
+                     post_id=self.post.pk),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    self.client.get(url)
+
+    def test_comment_invalidates_feeds(self):
+        urls = [
+            self.url('index'),
+            self.url('group', slug=self.group.slug),
+            self.url('profile', username=self.author.username),
+        ]
+        for url in urls:
+            self.client.get(url)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='comment'
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), '1 комментариев')
+
+    def test_changing_group_invalidates_both_groups(self):
+        old_url = self.url('group', slug=self.group.slug)
+        new_url = self.url('group', slug=self.other_group.slug)
+        self.assertContains(self.client.get(old_url), 'cached post')
+        self.assertNotContains(self.client.get(new_url), 'cached post')
+
+        self.post.group = self.other_group
+        self.post.save()
+        self.assertNotContains(self.client.get(old_url), 'cached post')
+        self.assertContains(self.client.get(new_url), 'cached post')
+
+    def test_follow_invalidates_profile(self):
+        url = self.url('profile', username=self.author.username)
+        self.assertContains(self.client.get(url), 'Подписчиков: 0')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertContains(self.client.get(url), 'Подписчиков: 1')
+
+    def test_unread_parameters_share_the_page(self):
+        url = self.url('index')
+        self.client.get(url, {'page': 1})
+        with self.assertNumQueries(0):
+            self.client.get(url, {'page': 1, 'utm_source': 'feed'})
+            self.client.get(url, {'utm_source': 'other', 'page': 1})
+
+    def test_entries_expire(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as set_entry:
+            self.client.get(self.url('index'))
+        timeouts = {}
+        for call in set_entry.call_args_list:
+            key = call.args[0]
+            if key.startswith(('posts:page:', 'posts:count:',
+                               'template.cache.post_card.')) \
+                    and not key.endswith(':lock'):
+                timeouts[key.split(':')[1] if ':' in key else 'card'] = (
+                    call.args[2]
+                )
+        stored = (
+            settings.POSTS_CACHE_TIMEOUT + settings.POSTS_CACHE_LOCK_TIMEOUT
+        )
+        self.assertEqual(timeouts, {
+            'page': stored, 'count': stored,
+            'card': settings.POSTS_CACHE_TIMEOUT,
+        })
+
+    def test_untouched_scopes_stay_cached(self):
+        url = self.url('group', slug=self.other_group.slug)
+        self.client.get(url)
+        Post.objects.create(author=self.author, text='ungrouped')
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='etag_author')
+        self.reader = User.objects.create_user(username='etag_reader')
+        self.group = Group.objects.create(
+            title='etag_group', slug='etag_group', description='test'
+        )
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='etag post'
+        )
+        self.urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': self.group.slug}),
+            reverse('profile', kwargs={'username': self.author.username}),
+            reverse('post', kwargs={'username': self.author.username,
+                                    'post_id': self.post.pk}),
+        ]
+        cache.clear()
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response.content, b'')
+
+    def test_changes_invalidate_etag(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='comment'
+        )
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_viewer(self):
+        url = self.urls[0]
+        anonymous = self.client.get(url)
+        self.assertIn('no-cache', anonymous['Cache-Control'])
+        self.assertNotIn('private', anonymous['Cache-Control'])
+
+        self.client.force_login(self.reader)
+        self.client.get(reverse('new_post'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+
+class PostCardCacheTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='card_author')
+        self.reader = User.objects.create_user(username='card_reader')
+        self.post = Post.objects.create(author=self.author, text='card')
+        cache.clear()
+
+    def card_key(self, viewer_is_author=False):
+        version, = get_versions(f'post:{self.post.pk}')
+        return make_template_fragment_key('post_card', [
+            self.post.pk, version, viewer_is_author, 'pending',
+            self.author.username, self.author.get_full_name(), '', '',
+        ])
+
+    def test_card_is_shared_between_pages(self):
+        self.client.get(reverse('index'))
+        self.assertIsNotNone(cache.get(self.card_key()))
+
+        cache.set(self.card_key(), 'cached card')
+        response = self.client.get(
+            reverse('profile', kwargs={'username': self.author.username})
+        )
+        self.assertContains(response, 'cached card')
+
+    def test_comment_regenerates_card(self):
+        self.client.get(reverse('index'))
+        old_key = self.card_key()
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='comment'
+        )
+        self.assertNotEqual(self.card_key(), old_key)
+        self.assertContains(
+            self.client.get(reverse('index')), '1 комментариев'
+        )
+
+    def test_renamed_author_and_group_regenerate_card(self):
+        group = Group.objects.create(
+            title='old_title', slug='old_slug', description='test'
+        )
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        self.client.get(reverse('index'))
+
+        group.title, group.slug = 'new_title', 'new_slug'
+        group.save()
+        self.author.username = 'renamed_author'
+        self.author.save()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '#new_title')
+        self.assertContains(response, '/group/new_slug/')
+        self.assertContains(response, '@renamed_author')
+
+    def test_edit_link_varies_by_viewer(self):
+        self.client.force_login(self.reader)
+        self.client.get(reverse('index'))
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Редактировать')
+        self.assertIsNotNone(cache.get(self.card_key(viewer_is_author=True)))
+
+
+# cache.add() is only atomic on locmem, memcached and Redis backends.
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}})
+class GetOrComputeTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return 'value'
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+
+        def worker():
+            results.append(get_or_compute('hot', self.compute, 60))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_while_refreshing(self):
+        cache.set('hot', ('stale', 1, time.time() - 1))
+        cache.set(LOCK_KEY.format('hot'), True)
+        self.assertEqual(get_or_compute('hot', self.compute, 60), 'stale')
+        self.assertEqual(self.calls, 0)
+
+    def test_expiring_value_is_refreshed_early(self):
+        cache.set('hot', ('old', 1000, time.time() + 1))
+        self.assertEqual(get_or_compute('hot', self.compute, 60), 'value')
+        self.assertEqual(get_or_compute('hot', self.compute, 60), 'value')
+        self.assertEqual(self.calls, 1)
+
+    def test_default_timeout_allows_early_refresh(self):
+        timeout = settings.POSTS_CACHE_TIMEOUT
+        get_or_compute('hot', self.compute, timeout)
+        _, delta, expires_at = cache.get('hot')
+        self.assertAlmostEqual(expires_at, time.time() + timeout, delta=5)
+        # Past the expiry the value is still there for the other workers.
+        with mock.patch('posts.cache.time.time',
+                        return_value=expires_at + 1):
+            self.assertFalse(is_fresh(expires_at, delta))
+            self.assertEqual(cache.get('hot')[0], 'value')
+
+
+class CountingPaginatorTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='count_author')
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'post {i}') for i in range(120)
+        )
+        cache.clear()
+
+    def test_index_count_is_cached_between_pages(self):
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('index'), {'page': 2})
+        self.assertEqual(response.context['paginator'].count, 120)
+
+        Post.objects.create(author=self.author, text='one more')
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertEqual(response.context['paginator'].count, 121)
+
+    def test_profile_count_comes_from_stats(self):
+        UserStats.objects.filter(user=self.author).update(posts_count=35)
+        response = self.client.get(
+            reverse('profile', kwargs={'username': self.author.username})
+        )
+        self.assertEqual(response.context['paginator'].num_pages, 4)
+
+    def test_page_range_is_elided(self):
+        response = self.client.get(reverse('index'), {'page': 6})
+        self.assertContains(response, '…', count=2)
+        self.assertContains(response, '?page=12"')
+        self.assertNotContains(response, '?page=2"')
+        self.assertNotContains(response, '?page=9"')
+
+
+class ExplainFeedsTest(TestCase):
+
+    def test_plans_use_feed_indexes(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            plans = os.path.join(directory, 'plans.json')
+            call_command('explain_feeds', seed=50, output=plans, stdout=out)
+            call_command('explain_feeds', seed=50, compare=plans, stdout=out)
+        self.assertIn('Plans are unchanged', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+        if connection.vendor == 'sqlite':
+            self.assertIn('posts_post_group_date', out.getvalue())
+            self.assertIn('posts_post_author_date', out.getvalue())
+
+
+class ExportDataTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='export_author')
+        self.reader = User.objects.create_user(username='export_reader')
+        self.group = Group.objects.create(
+            title='export_group', slug='export_group', description='test'
+        )
+        self.old = Post.objects.create(
+            author=self.author, group=self.group, text='старая запись'
+        )
+        Post.objects.filter(pk=self.old.pk).update(
+            pub_date=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        self.new = Post.objects.create(author=self.author, text='новая')
+        Post.objects.create(author=self.reader, text='чужая')
+        Comment.objects.create(
+            post=self.old, author=self.reader, text='комментарий'
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_data', '--chunk-size=1', *args,
+                     stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_jsonl_matches_dumpdata_records(self):
+        out, err = self.export()
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(
+            [record['model'] for record in records],
+            ['posts.group'] + ['posts.post'] * 3
+            + ['posts.comment', 'posts.follow']
+        )
+        self.assertEqual(records[1]['pk'], self.old.pk)
+        self.assertEqual(records[1]['fields']['author'], self.author.pk)
+        self.assertEqual(records[1]['fields']['group'], self.group.pk)
+        self.assertEqual(
+            records[1]['fields']['pub_date'], '2020-01-01T00:00:00Z'
+        )
+        self.assertIn('posts 3, comments 1, follows 1', err)
+
+    def test_filters(self):
+        out, _ = self.export('posts', '--author=export_author',
+                             '--since=2021-01-01')
+        self.assertEqual(
+            [json.loads(line)['pk'] for line in out.splitlines()],
+            [self.new.pk]
+        )
+        out, _ = self.export('posts', 'comments', '--group=export_group')
+        self.assertEqual(len(out.splitlines()), 2)
+        out, _ = self.export('comments', '--until=2021-01-01')
+        self.assertEqual(out, '')
+
+    def test_gzip_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.csv.gz')
+            self.export('posts', '--format=csv', f'--output={path}')
+            with gzip.open(path, 'rt', newline='') as export:
+                rows = list(csv.DictReader(export))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['text'], 'старая запись')
+        self.assertEqual(rows[1]['group'], '')
+
+    def test_csv_takes_one_model(self):
+        with self.assertRaises(CommandError):
+            self.export('--format=csv')
+
+
+class ImportDataTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def load(self, path, *args):
+        out = io.StringIO()
+        call_command('import_data', path, '--batch-size=7', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_imports_dumpdata_fixture(self):
+        out = self.load(os.path.join(settings.BASE_DIR, 'dump.json'))
+        self.assertIn('rows/s', out)
+        self.assertIn('sessions.session 11', out)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(
+            sum(UserStats.objects.values_list('posts_count', flat=True)), 40
+        )
+        self.assertIn(
+            Post.objects.get(pk=2), search_posts('тетрадь')
+        )
+        self.assertEqual(
+            Post.objects.get(pk=2).pub_date,
+            datetime(1854, 3, 14, tzinfo=timezone.utc)
+        )
+
+    @override_settings(TIMELINE_ENABLED=True)
+    def test_round_trip_with_export(self):
+        author = User.objects.create_user(username='import_author')
+        reader = User.objects.create_user(username='import_reader')
+        group = Group.objects.create(
+            title='import_group', slug='import_group', description='test'
+        )
+        posts = [
+            Post.objects.create(author=author, group=group, text=f'post {i}')
+            for i in range(10)
+        ]
+        for post in posts[:3]:
+            Comment.objects.create(post=post, author=reader, text='comment')
+        Follow.objects.create(user=reader, author=author)
+        Post.objects.filter(pk=posts[0].pk).update(image='posts/legacy.jpg')
+        # Whole seconds: the JSON export keeps milliseconds only.
+        published = datetime(2020, 1, 31, tzinfo=timezone.utc)
+        for days, post in enumerate(reversed(posts)):
+            post.pub_date = published - timedelta(days=days)
+        Post.objects.bulk_update(posts, ['pub_date'])
+        Comment.objects.update(created=published)
+        pub_dates = dict(Post.objects.values_list('pk', 'pub_date'))
+        created = dict(Comment.objects.values_list('pk', 'created'))
+        # Load into the same database: the export is the only source.
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.jsonl.gz')
+            call_command('export_data', output=path, stderr=io.StringIO())
+            Group.objects.all().delete()
+            Post.objects.all().delete()
+            Follow.objects.all().delete()
+            self.assertEqual(self.get_posts_count(author), 0)
+            self.load(path)
+            self.load(path, '--skip-existing')
+
+        self.assertEqual(Post.objects.count(), 10)
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertEqual(
+            dict(Post.objects.values_list('pk', 'pub_date')), pub_dates
+        )
+        self.assertEqual(
+            dict(Comment.objects.values_list('pk', 'created')), created
+        )
+        self.assertEqual(Post.objects.get(pk=posts[0].pk).comment_count, 1)
+        self.assertEqual(self.get_posts_count(author), 10)
+        self.assertEqual(
+            UserStats.objects.get(user=reader).following_count, 1
+        )
+        self.assertEqual(list(timeline.posts_for(reader)), posts[::-1])
+        self.assertEqual(
+            MediaFile.objects.get(name='posts/legacy.jpg').references, 1
+        )
+
+    def get_posts_count(self, user):
+        return UserStats.objects.get(user=user).posts_count
+
+    def test_truncated_fixture(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as fixture:
+            fixture.write('[{"model": "posts.group", "pk": 1, "fields": {')
+            fixture.flush()
+            with self.assertRaises(CommandError):
+                self.load(fixture.name)
+
+
+class ImportDeferredIndexesTest(TransactionTestCase):
+
+    def test_indexes_are_rebuilt(self):
+        call_command(
+            'import_data', os.path.join(settings.BASE_DIR, 'dump.json'),
+            '--defer-indexes', stdout=io.StringIO()
+        )
+        self.assertEqual(Post.objects.count(), 40)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Post._meta.db_table
+            )
+        for index in Post._meta.indexes:
+            self.assertIn(index.name, constraints)
+
+
+class BudgetTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='budget_author')
+        for i in range(3):
+            user = User.objects.create_user(username=f'budget_user_{i}')
+            Post.objects.create(author=user, text=f'post {i}')
+
+    def test_failure_lists_repeated_queries(self):
+        with self.assertRaises(BudgetExceeded) as error:
+            with budget('authors', queries=2, rows=3):
+                for post in Post.objects.all():
+                    post.author.username
+        message = str(error.exception)
+        self.assertIn('4 queries (budget 2), 6 rows (budget 3)', message)
+        self.assertIn('+ 3 x SELECT', message)
+        self.assertIn('WHERE "auth_user"."id" = ?', message)
+
+    @within_budget(queries=1, rows=6)
+    def test_feed_joins_authors(self):
+        for post in Post.objects.feed():
+            post.author.username
+
+
+@override_settings(POSTS_TIMING_SAMPLE_RATE=1)
+class ServerTimingTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='timing_author')
+        for i in range(3):
+            Post.objects.create(author=self.author, text=f'post {i}')
+        cache.clear()
+
+    def test_header_and_log_line(self):
+        with self.assertLogs('posts.timing', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        timing = response['Server-Timing']
+        self.assertRegex(
+            timing, rf'db;dur=[\d.]+;desc="{len(queries)} queries"'
+        )
+        self.assertRegex(timing, r'render;dur=(?!0\.0,)[\d.]+')
+        self.assertIn('cache;desc="0 hits, 2 misses"', timing)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'index')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['queries'], len(queries))
+
+        with self.assertLogs('posts.timing', 'INFO'):
+            timing = self.client.get(reverse('index'))['Server-Timing']
+        self.assertIn('db;dur=0.0;desc="0 queries"', timing)
+        self.assertIn('render;dur=0.0', timing)
+        self.assertIn('cache;desc="1 hits, 0 misses"', timing)
+
+    @override_settings(POSTS_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username='profiled_author')
+        Post.objects.create(author=self.author, text='profiled post')
+        self.staff = User.objects.create_user(
+            username='profiling_staff', is_staff=True
+        )
+
+    def test_sampled_stacks_are_collapsed(self):
+        def busy_loop():
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+
+        with SamplingProfiler(0.001) as profiler:
+            busy_loop()
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r'^[^ ].*[^;] \d+$')
+        self.assertIn('busy_loop (posts/tests.py:', lines[0])
+
+    def test_staff_gets_a_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('index'), {'profile': 'sample'})
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['X-Profiled-Status'], '200')
+        self.assertIn('no-cache', response['Cache-Control'])
+        for line in response.content.decode().splitlines():
+            self.assertRegex(line, r' \d+$')
+
+        response = self.client.get(
+            reverse('profile', args=[self.author.username]),
+            HTTP_X_PROFILE='cprofile',
+        )
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIn('function calls', response.content.decode())
+
+    def test_cached_page_is_profiled(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+        # Pages of authenticated users are cached per CSRF cookie.
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 64
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'), {'profile': 'cprofile'})
+        self.assertIn('(index)', response.content.decode())
+
+    def test_others_get_the_page(self):
+        for user in (None, self.author):
+            if user:
+                self.client.force_login(user)
+            response = self.client.get(reverse('index'), {'profile': 'sample'})
+            self.assertContains(response, 'profiled post')
+            self.assertFalse(response.has_header('X-Profiled-Status'))
+
+    @override_settings(POSTS_SLOW_QUERY_MS=1e-6)
+    def test_slow_queries_are_logged_with_plans(self):
+        cache.clear()
+        with self.assertLogs('posts.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual({entry['view'] for entry in entries}, {'index'})
+        selects = [entry for entry in entries
+                   if entry['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for entry in selects:
+            self.assertRegex(entry['plan'], r'SCAN|SEARCH')
+            self.assertIsNone(entry['params'])
+
+    @override_settings(POSTS_SLOW_QUERY_MS=1e-6, POSTS_SLOW_QUERY_PARAMS=True)
+    def test_params_are_logged_on_request(self):
+        cache.clear()
+        with self.assertLogs('posts.slow_queries', 'WARNING') as logs:
+            self.client.get(
+                reverse('profile', args=[self.author.username])
+            )
+        params = [json.loads(record.getMessage())['params']
+                  for record in logs.records]
+        self.assertIn([self.author.username], params)
+
+    def test_plan_is_redacted(self):
+        self.assertEqual(
+            redact("Filter: (text = 'it''s'::text) AND (id = 1)",
+                   ["it's", 1]),
+            "Filter: (text = '?'::text) AND (id = 1)"
+        )
+
+    @override_settings(POSTS_SLOW_QUERY_MS=0)
+    def test_slow_query_log_can_be_turned_off(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('posts.slow_queries', 'WARNING'):
+                self.client.get(reverse('index'))
+
+
+class SeedDataTest(TestCase):
+
+    def test_activity_is_skewed(self):
+        call_command('seed_data', users=50, posts=500, comments=300,
+                     follows=10, groups=3, stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(Post.objects.count(), 500)
+        self.assertEqual(Comment.objects.count(), 300)
+        counts = sorted(
+            UserStats.objects.values_list('posts_count', flat=True),
+            reverse=True
+        )
+        self.assertEqual(sum(counts), 500)
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+        followers = sorted(
+            UserStats.objects.values_list('followers_count', flat=True)
+        )
+        self.assertGreater(followers[-1], 2 * followers[len(followers) // 2])
+
+    def test_dates_are_spread(self):
+        call_command('seed_data', users=5, posts=50, comments=50, days=30,
+                     stdout=io.StringIO())
+        dates = list(
+            Post.objects.order_by('pk').values_list('pub_date', flat=True)
+        )
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(len(set(dates)), 50)
+        self.assertGreater(dates[-1] - dates[0], timedelta(days=20))
+        for comment in Comment.objects.select_related('post'):
+            self.assertGreaterEqual(comment.created, comment.post.pub_date)
+
+
+class BenchmarkTest(TestCase):
+
+    def setUp(self):
+        call_command('seed_data', users=20, posts=60, comments=60,
+                     follows=5, groups=2, stdout=io.StringIO())
+        cache.clear()
+
+    def test_report(self):
+        posts = Post.objects.count()
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark', requests=4, warmup=1, cold=True,
+                         output=path, stdout=out, stderr=io.StringIO())
+            call_command('benchmark', 'index', requests=2, compare=path,
+                         stdout=out, stderr=io.StringIO())
+            with open(path) as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual(Post.objects.count(), posts)
+        self.assertEqual(report['dataset']['post'], posts)
+        self.assertEqual(
+            list(report['views']),
+            ['index', 'group_posts', 'profile', 'post_view',
+             'follow_index', 'new_post', 'add_comment']
+        )
+        for view, result in report['views'].items():
+            with self.subTest(view=view):
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertGreater(result['queries_max'], 0)
+        self.assertIn('Compared with', out.getvalue())
+
+    def test_requests_must_be_positive(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'index', requests=0,
+                         stdout=io.StringIO(), stderr=io.StringIO())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class ImageUploadTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='upload_user')
+        self.client.force_login(self.user)
+
+    def upload(self, image, image_format='JPEG', **save_options):
+        image_io = io.BytesIO()
+        image.save(image_io, image_format, **save_options)
+        upload = SimpleUploadedFile(
+            f'upload.{image_format.lower()}', image_io.getvalue()
+        )
+        return self.client.post(
+            reverse('new_post'), {'text': 'text', 'image': upload}
+        )
+
+    def noise(self, size):
+        return Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+
+    @override_settings(POSTS_UPLOAD_MAX_BYTES=1000)
+    def test_too_large_file(self):
+        response = self.upload(self.noise((40, 40)), 'PNG')
+        self.assertFormError(
+            response, 'form', 'image', 'Файл слишком большой: не больше 0 МБ.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_UPLOAD_MAX_BYTES=1000)
+    def test_too_large_file_stops_reading(self):
+        handler = LimitedUploadHandler(mock.Mock())
+        handler.new_file('image', 'upload.png', 'image/png', None)
+        handler.receive_data_chunk(b'x' * 600, 0)
+        with self.assertRaises(StopUpload) as stop:
+            handler.receive_data_chunk(b'x' * 600, 600)
+        self.assertTrue(stop.exception.connection_reset)
+        self.assertEqual(handler.request.oversized_field, 'image')
+
+    def admin_upload(self, image):
+        admin_user = User.objects.create_superuser(
+            username='upload_admin', email='admin@example.com',
+            password='password'
+        )
+        self.client.force_login(admin_user)
+        image_io = io.BytesIO()
+        image.save(image_io, 'PNG')
+        return self.client.post(reverse('admin:posts_post_add'), {
+            'text': 'text', 'author': admin_user.pk,
+            'image': SimpleUploadedFile('upload.png', image_io.getvalue()),
+        })
+
+    @override_settings(POSTS_UPLOAD_MAX_BYTES=1000)
+    def test_admin_reports_too_large_file(self):
+        response = self.admin_upload(self.noise((40, 40)))
+        self.assertContains(response, 'Файл слишком большой')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_IMAGE_MAX_SIDE=10)
+    def test_admin_uploads_are_processed(self):
+        self.admin_upload(self.noise((40, 20)))
+        with Image.open(Post.objects.get().image) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (10, 5)))
+
+    @override_settings(POSTS_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        response = self.upload(Image.new('RGB', (20, 20)))
+        self.assertFormError(
+            response, 'form', 'image',
+            'Изображение слишком большое: не больше 0 мегапикселей.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_IMAGE_MAX_SIDE=10)
+    def test_image_is_shrunk_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotated 90° clockwise
+        exif[0x010F] = 'Camera maker'
+        self.upload(self.noise((40, 20)), exif=exif)
+
+        post = Post.objects.get()
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (5, 10))
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertTrue(image.info.get('progressive'))
+
+    def test_transparent_png_is_flattened(self):
+        self.upload(Image.new('RGBA', (4, 4), (255, 0, 0, 0)), 'PNG')
+        with Image.open(Post.objects.get().image) as image:
+            self.assertEqual(image.mode, 'RGB')
+            self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'))
+class ContentAddressedStorageTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='storage_user')
+        self.client.force_login(self.user)
+        image_io = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(image_io, 'JPEG')
+        self.content = image_io.getvalue()
+
+    def create_post(self, name='photo.jpg', content=None):
+        return Post.objects.create(
+            author=self.user, text='text',
+            image=SimpleUploadedFile(name, content or self.content)
+        )
+
+    def test_duplicates_are_stored_once(self):
+        first = self.create_post('first.jpg')
+        second = self.create_post('second.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(
+            first.image.name,
+            r'^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$'
+        )
+        self.assertEqual(MediaFile.objects.get().references, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(second.image.path))
+        self.assertEqual(MediaFile.objects.get().references, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(second.image.path))
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_file_saved_again_before_commit_is_kept(self):
+        post = self.create_post()
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+            again = self.create_post('again.jpg')
+        self.assertEqual(again.image.name, post.image.name)
+        self.assertTrue(os.path.exists(again.image.path))
+        self.assertEqual(MediaFile.objects.get().references, 1)
+
+    def test_replaced_image_is_released(self):
+        post = self.create_post()
+        old_path = post.image.path
+        image_io = io.BytesIO()
+        Image.new('RGB', (4, 4), 'blue').save(image_io, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('post_edit', kwargs={'username': self.user.username,
+                                             'post_id': post.pk}),
+                {'text': 'text',
+                 'image': SimpleUploadedFile('new.png', image_io.getvalue())}
+            )
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.path, old_path)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(
+            list(MediaFile.objects.values_list('name', flat=True)),
+            [post.image.name]
+        )
+
+    def test_reuploaded_image_keeps_one_reference(self):
+        post = self.create_post()
+        names = []
+        # The form re-encodes uploads: the second one has the same name.
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse('post_edit', kwargs={
+                        'username': self.user.username, 'post_id': post.pk
+                    }),
+                    {'text': 'text',
+                     'image': SimpleUploadedFile('again.jpg', self.content)}
+                )
+            post.refresh_from_db()
+            names.append(post.image.name)
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(MediaFile.objects.get().references, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFalse(os.path.exists(post.image.path))
+        self.assertFalse(MediaFile.objects.exists())
+
+
+class CollectMediaTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        cache.clear()
+        self.user = User.objects.create_user(username='media_user')
+        self.kept = self.create_post('red')
+        self.deleted = self.create_post('blue')
+        self.kept_thumbnail = get_thumbnail(self.kept.image, '2x2')
+        self.orphan_thumbnail = get_thumbnail(self.deleted.image, '2x2')
+        # TestCase never commits, so the file outlives its reference.
+        self.deleted.delete()
+
+        self.stray_image = os.path.join(media_root, 'posts', 'stray.jpg')
+        self.stray_thumbnail = os.path.join(media_root, 'cache', 'stray.jpg')
+        for path in (self.stray_image, self.stray_thumbnail):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stray:
+                stray.write(b'x' * 10)
+
+    def create_post(self, color):
+        image_io = io.BytesIO()
+        Image.new('RGB', (4, 4), color).save(image_io, 'JPEG')
+        return Post.objects.create(
+            author=self.user, text='text',
+            image=SimpleUploadedFile(f'{color}.jpg', image_io.getvalue())
+        )
+
+    def collect(self, **options):
+        out = io.StringIO()
+        options.setdefault('min_age', 0)
+        call_command('collect_media', batch_size=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_deleting(self):
+        output = self.collect(dry_run=True)
+        image_size = self.deleted.image.size + 10
+        thumbnail_size = os.path.getsize(
+            self.orphan_thumbnail.storage.path(self.orphan_thumbnail.name)
+        ) + 10
+        self.assertIn(
+            f'Reclaimable: images 2 ({image_size} bytes), '
+            f'thumbnails 2 ({thumbnail_size} bytes)', output
+        )
+        self.assertTrue(os.path.exists(self.deleted.image.path))
+        self.assertTrue(os.path.exists(self.stray_thumbnail))
+
+    def test_orphans_are_removed(self):
+        self.assertIn('Removed: images 2', self.collect())
+        self.assertFalse(os.path.exists(self.deleted.image.path))
+        self.assertFalse(os.path.exists(self.stray_image))
+        self.assertFalse(os.path.exists(self.stray_thumbnail))
+        self.assertFalse(self.orphan_thumbnail.exists())
+        self.assertTrue(os.path.exists(self.kept.image.path))
+        self.assertTrue(self.kept_thumbnail.exists())
+        self.assertIn('Removed: images 0 (0 bytes), thumbnails 0',
+                      self.collect())
+
+    def test_recent_files_are_kept(self):
+        self.assertIn('images 0', self.collect(dry_run=True, min_age=1))
+
+    def test_deleted_image_takes_its_thumbnails(self):
+        post = self.create_post('green')
+        thumbnail = get_thumbnail(post.image, '2x2')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFalse(os.path.exists(post.image.path))
+        self.assertFalse(thumbnail.exists())
+        self.assertTrue(self.kept_thumbnail.exists())
+
+    def test_thumbnails_of_vanished_images_are_removed(self):
+        os.remove(self.deleted.image.path)
+        output = self.collect()
+        self.assertIn('Removed: images 1', output)
+        self.assertIn('thumbnails 2', output)
+        self.assertFalse(self.orphan_thumbnail.exists())
+        self.assertTrue(self.kept_thumbnail.exists())
+
+    def test_referenced_files_are_kept(self):
+        # An upload that reused the file and has not committed its post.
+        MediaFile.objects.create(name=self.deleted.image.name, references=1)
+        self.assertIn('Removed: images 1', self.collect())
+        self.assertTrue(os.path.exists(self.deleted.image.path))
+        self.assertTrue(MediaFile.objects.filter(
+            name=self.deleted.image.name
+        ).exists())
+
+
+@override_settings(MEDIA_ROOT=(TEST_DIR + '/media'),
+                   POSTS_THUMBNAIL_WORKERS=0,
+                   POSTS_THUMBNAILS={'card': {
+                       'size': (10, 5),
+                       'widths': [10],
+                       'formats': ['JPEG'],
+                       'options': {'crop': 'center'},
+                       'sizes': '100vw',
+                   }})
+class ThumbnailTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='thumb_user')
+        self.client.force_login(self.user)
+
+    def image(self, name='thumb.png'):
+        image_io = io.BytesIO()
+        Image.frombytes('RGB', (20, 20), os.urandom(20 * 20 * 3)).save(
+            image_io, 'PNG'
+        )
+        return SimpleUploadedFile(name, image_io.getvalue(), 'image/png')
+
+    @mock.patch('posts.thumbnails.get_thumbnail')
+    def test_new_image_is_rendered_after_commit(self, get_thumbnail):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('new_post'), {'text': 'text', 'image': self.image()}
+            )
+        post = Post.objects.get(author=self.user)
+        get_thumbnail.assert_called_once_with(
+            mock.ANY, '10x5', crop='center', format='JPEG'
+        )
+        self.assertEqual(get_thumbnail.call_args[0][0].name, post.image.name)
+
+    @mock.patch('posts.thumbnails.get_thumbnail')
+    def test_text_edit_does_not_render(self, get_thumbnail):
+        post = Post.objects.create(
+            author=self.user, text='text', image=self.image()
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('post_edit', kwargs={'username': self.user.username,
+                                             'post_id': post.pk}),
+                {'text': 'edited'}
+            )
+        get_thumbnail.assert_not_called()
+
+    @mock.patch('posts.thumbnails.get_thumbnail')
+    def test_warm_thumbnails(self, get_thumbnail):
+        for name in ('first.png', 'second.png'):
+            Post.objects.create(
+                author=self.user, text='text', image=self.image(name)
+            )
+        Post.objects.create(author=self.user, text='no image')
+        out = io.StringIO()
+        call_command('warm_thumbnails', workers=1, stdout=out)
+        self.assertEqual(get_thumbnail.call_count, 2)
+        self.assertIn('Images: 2', out.getvalue())
+
+    def test_page_thumbnails_are_batched(self):
+        posts = [
+            Post.objects.create(
+                author=self.user, text='text', image=self.image(f'{i}.png')
+            )
+            for i in range(3)
+        ]
+        Post.objects.create(author=self.user, text='no image')
+        expected = [
+            get_thumbnail(post.image, '10x5', crop='center', format='JPEG')
+            for post in posts
+        ]
+        cache.clear()
+
+        posts = list(Post.objects.feed())
+        with self.assertNumQueries(1):
+            thumbnails.resolve(posts)
+        with self.assertNumQueries(0):
+            thumbnails.resolve(posts)
+        self.assertEqual(
+            [post.thumbnails['card'].src for post in reversed(posts[1:])],
+            [thumbnail.url for thumbnail in expected]
+        )
+        self.assertEqual(posts[0].thumbnails, {})
+        self.assertContains(
+            self.client.get(reverse('index')), expected[0].url
+        )
+
+    @mock.patch('posts.thumbnails.get_thumbnail')
+    def test_missing_thumbnails_are_not_rendered(self, get_thumbnail):
+        post = Post.objects.create(
+            author=self.user, text='text', image=self.image()
+        )
+        cache.clear()
+        thumbnails.resolve([post])
+        self.assertFalse(post.thumbnails['card'])
+        response = self.client.get(reverse('index'))
+        get_thumbnail.assert_not_called()
+        self.assertContains(response, f'src="{post.image.url}"')
+
+    def test_picture_has_srcset_per_format(self):
+        config = {
+            'size': (20, 10),
+            'widths': [10, 20],
+            'formats': ['AVIF', 'WEBP', 'JPEG'],
+            'options': {'crop': 'center'},
+            'sizes': '100vw',
+        }
+        post = Post.objects.create(
+            author=self.user, text='text', image=self.image()
+        )
+        with self.settings(POSTS_THUMBNAILS={'card': config}):
+            thumbnails.generate(post.image.name)
+            picture = thumbnails.resolve([post])[0].thumbnails['card']
+            response = self.client.get(reverse('index'))
+
+        formats = ['WEBP', 'JPEG']
+        if 'AVIF' in Image.SAVE:
+            formats.insert(0, 'AVIF')
+        self.assertEqual(list(picture.formats), formats)
+        self.assertEqual(
+            [source['type'] for source in picture.sources],
+            [Image.MIME[image_format] for image_format in formats[:-1]]
+        )
+        self.assertRegex(picture.sources[-1]['srcset'],
+                         r'^\S+\.webp 10w, \S+\.webp 20w$')
+        self.assertRegex(picture.srcset, r'^\S+\.jpg 10w, \S+\.jpg 20w$')
+        self.assertTrue(picture.src.endswith('.jpg'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'src="{picture.src}"')
+
+
 def tearDownModule():
     print('\nDeleting temporary files...\n')
     try:
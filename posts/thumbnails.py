@@ -0,0 +1,233 @@
+"""Eager thumbnail generation.
+
+``{% thumbnail %}`` renders a missing thumbnail inline, so the first page
+showing a new image would block a worker on decoding and resizing it.
+Images saved through ``PostForm`` are handed to a background thread pool
+once the transaction commits, which renders every variant from
+``POSTS_THUMBNAILS`` in each of its widths and formats;
+``manage.py warm_thumbnails`` does the same for images that are already
+stored.
+
+Pages do not use ``{% thumbnail %}``, which costs a key-value store lookup
+per image: ``resolve`` fetches the thumbnails of all posts on a page with
+one ``get_many`` on the cache behind the store, plus one query for the
+keys the cache has lost. Each variant is exposed as a ``Picture`` that
+templates turn into ``<picture>`` with ``srcset`` per format. Pages never
+render a thumbnail themselves: until the background job or
+``warm_thumbnails`` has made them, the original image is shown.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+# sorl only knows the formats Pillow supported at its release; AVIF needs
+# Pillow 11.3+ or pillow-avif-plugin.
+Image.init()
+if 'AVIF' in Image.SAVE:
+    EXTENSIONS.setdefault('AVIF', 'avif')
+
+
+class Picture:
+    """One image in every width and format of a ``POSTS_THUMBNAILS`` variant.
+
+    Formats go in order of preference; the last one rendered is the
+    fallback for the ``<img>`` tag.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.formats = {}
+
+    def __bool__(self):
+        return bool(self.formats)
+
+    def add(self, image_format, width, thumbnail):
+        self.formats.setdefault(image_format, []).append((width, thumbnail))
+
+    def get_srcset(self, image_format):
+        return ', '.join(
+            f'{thumbnail.url} {width}w'
+            for width, thumbnail in sorted(self.formats[image_format])
+        )
+
+    @property
+    def fallback(self):
+        return list(self.formats)[-1]
+
+    @property
+    def sources(self):
+        return [
+            {'type': Image.MIME[image_format],
+             'srcset': self.get_srcset(image_format)}
+            for image_format in list(self.formats)[:-1]
+        ]
+
+    @property
+    def srcset(self):
+        return self.get_srcset(self.fallback)
+
+    @property
+    def src(self):
+        return max(self.formats[self.fallback])[1].url
+
+
+def get_renditions():
+    """
+    ``(variant, format, width, geometry, options)`` for everything
+    ``POSTS_THUMBNAILS`` asks for in formats Pillow can write.
+    """
+    renditions = []
+    for variant, config in settings.POSTS_THUMBNAILS.items():
+        base_width, base_height = config['size']
+        for image_format in config['formats']:
+            if image_format not in Image.SAVE or \
+                    image_format not in EXTENSIONS:
+                continue
+            for width in config['widths']:
+                height = round(width * base_height / base_width)
+                renditions.append((
+                    variant, image_format, width, f'{width}x{height}',
+                    {**config['options'], 'format': image_format},
+                ))
+    return renditions
+
+
+def source_file(name):
+    """Post image ``name`` as sorl sees it, on the field's own storage."""
+    return ImageFile(name, Post._meta.get_field('image').storage)
+
+
+def delete_thumbnails(name):
+    """Remove the thumbnails of ``name`` and their key-value store entries."""
+    default.kvstore.delete(source_file(name))
+
+
+def generate(name):
+    for _, _, _, geometry, options in get_renditions():
+        get_thumbnail(source_file(name), geometry, **options)
+    return name
+
+
+def generate_in_background(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Could not generate thumbnails for %s', name)
+    finally:
+        # Pool threads keep their own connections, close them after use.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.POSTS_THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def schedule(image):
+    """Render thumbnails of ``image`` after the current transaction."""
+    if not image:
+        return
+    name = image.name
+
+    def submit():
+        if settings.POSTS_THUMBNAIL_WORKERS:
+            get_executor().submit(generate_in_background, name)
+        else:
+            generate(name)
+
+    transaction.on_commit(submit)
+
+
+def thumbnail_file(name, geometry, options):
+    """
+    The thumbnail ``get_thumbnail()`` would look up for post image
+    ``name``, built the same way as in ``ThumbnailBackend.get_thumbnail``.
+    """
+    backend = default.backend
+    source = source_file(name)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage
+    )
+
+
+def get_stored(keys):
+    """Serialized thumbnails for ``keys`` found in the key-value store."""
+    kvstore_cache = default.kvstore.cache
+    found = {
+        key: value for key, value in kvstore_cache.get_many(keys).items()
+        if value != EMPTY_VALUE
+    }
+    missing = [key for key in keys if key not in found]
+    if missing:
+        stored = dict(KVStore.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        kvstore_cache.set_many(stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(stored)
+    return found
+
+
+def resolve(posts):
+    """
+    Attach ``post.thumbnails``, a dict of ``Picture`` by the variant
+    names of ``POSTS_THUMBNAILS``. Renditions missing from the store are
+    left out rather than rendered on the spot, so a variant nothing has
+    been generated for yet is an empty ``Picture``.
+    """
+    renditions = get_renditions()
+    wanted = {}
+    for post in posts:
+        post.thumbnails = {}
+        if not post.image:
+            continue
+        for variant, config in settings.POSTS_THUMBNAILS.items():
+            post.thumbnails[variant] = Picture(config['sizes'])
+        for rendition in renditions:
+            geometry, options = rendition[3:]
+            key = add_prefix(thumbnail_file(
+                post.image.name, geometry, options
+            ).key)
+            wanted[key] = (post, rendition)
+    if not wanted:
+        return posts
+
+    stored = get_stored(list(wanted))
+    for key, (post, rendition) in wanted.items():
+        variant, image_format, width = rendition[:3]
+        if key in stored:
+            post.thumbnails[variant].add(
+                image_format, width, deserialize_image_file(stored[key])
+            )
+    return posts
@@ -0,0 +1,214 @@
+"""Fan-out-on-write timeline for ``follow_index``.
+
+New posts are copied into ``TimelineEntry`` rows of every follower, so the
+follow feed is read from a single ``(user, -pub_date, -post)`` index instead of
+joining ``Follow`` with ``Post``. Authors with more than
+``TIMELINE_FANOUT_LIMIT`` followers are not fanned out: a page reads their
+newest posts from the ``(author, -pub_date)`` index and merges them with
+the timeline page (see ``Feed``). Timelines keep at most
+``TIMELINE_MAX_LENGTH`` entries; ``manage.py rebuild_timelines --trim-only``
+enforces the cap periodically.
+"""
+import heapq
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils.functional import cached_property
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .pagination import CursorPaginator
+
+BATCH_SIZE = 1000
+
+
+def is_enabled():
+    return settings.TIMELINE_ENABLED
+
+
+def is_fanned_out(author_id):
+    return not UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).exists()
+
+
+def fan_out(post):
+    if not is_fanned_out(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    entries = []
+    for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+        entries.append(TimelineEntry(
+            user_id=user_id, post_id=post.pk, pub_date=post.pub_date
+        ))
+        if len(entries) == BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill(user_id, author_id):
+    if not is_fanned_out(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:settings.TIMELINE_MAX_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim(user_id)
+
+
+def remove(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def trim(user_id):
+    """Drop entries older than the newest ``TIMELINE_MAX_LENGTH`` ones."""
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    oldest_kept = entries.order_by('-pub_date', '-post_id').values_list(
+        'pub_date', 'post_id'
+    )[settings.TIMELINE_MAX_LENGTH - 1:settings.TIMELINE_MAX_LENGTH]
+    if not oldest_kept:
+        return 0
+    pub_date, post_id = oldest_kept[0]
+    deleted, _ = entries.filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, post_id__lt=post_id)
+    ).delete()
+    return deleted
+
+
+def count_for(user):
+    """Number of posts in ``posts_for(user)`` without counting the join."""
+    follows = Follow.objects.filter(user=user)
+    if is_enabled():
+        fanned_in = follows.filter(
+            author__stats__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+        )
+        return (
+            TimelineEntry.objects.filter(user=user).count()
+            + (fanned_in.aggregate(
+                count=Sum('author__stats__posts_count'))['count'] or 0)
+        )
+    return follows.aggregate(
+        count=Sum('author__stats__posts_count')
+    )['count'] or 0
+
+
+def sort_key(post):
+    return post.pub_date, post.pk
+
+
+class Feed:
+    """
+    The follow feed as a sequence for ``Paginator`` and ``TimelinePaginator``.
+
+    Every page is at most ``limit`` rows from the user's timeline index plus
+    ``limit`` rows per fanned-in author from that author's index, merged in
+    Python, so the cost of a page does not grow with the size of the feed.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def fanned_in(self):
+        return list(Follow.objects.filter(
+            user=self.user,
+            author__stats__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+        ).values_list('author_id', flat=True))
+
+    def count(self):
+        return count_for(self.user)
+
+    def sources(self, older_than=None, newer_than=None):
+        """
+        One queryset per source, ordered like the page: newest first, or
+        oldest first past a ``newer_than`` cursor.
+        """
+        descending = newer_than is None
+        if descending:
+            order, lookup, cursor = '-', 'lt', older_than
+        else:
+            order, lookup, cursor = '', 'gt', newer_than
+
+        entries = TimelineEntry.objects.filter(user=self.user)
+        posts = [
+            Post.objects.feed().filter(author_id=author_id)
+            for author_id in self.fanned_in
+        ]
+        if cursor is not None:
+            pub_date, pk = cursor
+            entries = entries.filter(
+                Q(**{f'pub_date__{lookup}': pub_date})
+                | Q(pub_date=pub_date, **{f'post_id__{lookup}': pk})
+            )
+            posts = [queryset.filter(
+                Q(**{f'pub_date__{lookup}': pub_date})
+                | Q(pub_date=pub_date, **{f'pk__{lookup}': pk})
+            ) for queryset in posts]
+        entries = entries.select_related(
+            'post__author', 'post__group'
+        ).order_by(f'{order}pub_date', f'{order}post_id')
+        posts = [
+            queryset.order_by(f'{order}pub_date', f'{order}pk')
+            for queryset in posts
+        ]
+        return [entries, *posts]
+
+    def window(self, limit=None, older_than=None, newer_than=None):
+        """Up to ``limit`` posts past the cursor, in the sources' order."""
+        entries, *posts = [
+            queryset[:limit] if limit is not None else queryset
+            for queryset in self.sources(older_than, newer_than)
+        ]
+        merged = heapq.merge(
+            [entry.post for entry in entries], *posts,
+            key=sort_key, reverse=newer_than is None
+        )
+        # An author that crossed TIMELINE_FANOUT_LIMIT still has entries.
+        seen = set()
+        window = []
+        for post in merged:
+            if post.pk not in seen:
+                seen.add(post.pk)
+                window.append(post)
+                if len(window) == limit:
+                    break
+        return window
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('Feed supports only slices without a step')
+        return self.window(index.stop)[index.start:]
+
+    def __iter__(self):
+        return iter(self.window())
+
+
+class TimelinePaginator(CursorPaginator):
+    """``CursorPaginator`` that also pages a ``Feed``."""
+
+    def window(self, older_than=None, newer_than=None):
+        if not isinstance(self.object_list, Feed):
+            return super().window(older_than, newer_than)
+        return self.object_list.window(
+            self.per_page + 1, older_than, newer_than
+        )
+
+
+def posts_for(user):
+    """
+    Posts of the authors ``user`` follows, newest first: a queryset, or a
+    ``Feed`` when the timeline is on.
+    """
+    if not is_enabled():
+        return Post.objects.feed().filter(author__following__user=user)
+    return Feed(user)
@@ -1,22 +1,75 @@
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.http import urlencode
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from . import images, thumbnails, timeline
+from .cache import cache_versioned, cached_count, prepare_cards
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post
+from .models import Follow, Group, Post, UserStats
+from .pagination import CursorPaginator, counted_paginator, estimate_count
+from .search import QUERY_MAX_LENGTH, highlight, search_posts
 
 User = get_user_model()
 
-
-@cache_page(20)
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+
+
+def paginate(request, post_list, count, cursor_class=CursorPaginator):
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before:
+        paginator = cursor_class(post_list, POSTS_PER_PAGE)
+        page = paginator.get_page(after=after, before=before)
+    else:
+        paginator = counted_paginator(post_list, POSTS_PER_PAGE, count)
+        page = paginator.get_page(request.GET.get('page'))
+        page.page_range = list(paginator.get_elided_page_range(
+            page.number, on_each_side=2, on_ends=1
+        ))
+    page.object_list = thumbnails.resolve(
+        prepare_cards(page.object_list, request.user)
+    )
+    if not after and not before and page.has_next():
+        # Numbered pages get slower the deeper they go: hand the reader
+        # over to cursor pagination from here on.
+        page.next_cursor = cursor_class(
+            post_list, POSTS_PER_PAGE
+        ).cursor_for(page.object_list[-1])
+    return page, paginator
+
+
+def count_all_posts():
+    estimate = estimate_count(Post)
+    if estimate is not None and \
+            estimate >= settings.POSTS_COUNT_ESTIMATE_THRESHOLD:
+        return estimate
+    return cached_count('index', Post.objects.all(), 'global')
+
+
+def get_stats(user):
+    """
+    The user's counters. Raw saves (``loaddata``, bulk imports) create
+    users without them, so they are counted once here.
+    """
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        user.stats, _ = UserStats.objects.get_or_create(user=user, defaults={
+            'posts_count': user.posts.count(),
+            'followers_count': user.following.count(),
+            'following_count': user.follower.count(),
+        })
+        return user.stats
+
+
+@cache_versioned('global')
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.feed()
+    page, paginator = paginate(request, post_list, count_all_posts)
     return render(
         request,
         'index.html',
@@ -24,13 +77,14 @@ def index(request):
     )
 
 
+@cache_versioned('group:{slug}')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = group.posts.feed()
+    page, paginator = paginate(
+        request, post_list,
+        lambda: cached_count('group', group.posts.all(), f'group:{slug}')
+    )
 
     return render(
         request, 'group.html',
@@ -38,13 +92,39 @@ def group_posts(request, slug):
     )
 
 
+@cache_versioned('global')
+def search(request):
+    query = request.GET.get('q', '').strip()[:QUERY_MAX_LENGTH]
+    page = paginator = None
+    if query:
+        paginator = CursorPaginator(
+            search_posts(query), POSTS_PER_PAGE,
+            field='rank', value_type=float
+        )
+        page = paginator.get_page(
+            after=request.GET.get('after'), before=request.GET.get('before')
+        )
+        highlight(page.object_list, query)
+    return render(
+        request, 'posts/search.html',
+        {'query': query, 'page': page, 'paginator': paginator,
+         'page_query': urlencode({'q': query}) + '&'}
+    )
+
+
 @login_required
 def new_post(request):
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(
+        request.POST or None,
+        files=request.FILES or None,
+        oversized_field=images.oversized_field(request)
+    )
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        with transaction.atomic():
+            post.save()
+            thumbnails.schedule(post.image)
         return redirect('index')
     return render(request, 'posts/new_post.html', {'form': form})
 
@@ -57,24 +137,29 @@ def post_edit(request, username, post_id):
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        oversized_field=images.oversized_field(request)
     )
 
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post.image)
         return redirect('post', username=username, post_id=post_id)
 
     return render(request, 'posts/new_post.html', {'form': form, 'post': post})
 
 
+@cache_versioned('author:{username}')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
 
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = author.posts.feed()
+    page, paginator = paginate(
+        request, post_list, lambda: get_stats(author).posts_count
+    )
 
     user = request.user
 
@@ -89,13 +174,30 @@ def profile(request, username):
     )
 
 
+@cache_versioned('post:{post_id}', 'author:{username}')
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.feed().select_related('author__stats'),
+        author__username=username,
+        pk=post_id
+    )
+    thumbnails.resolve(prepare_cards([post], request.user))
+    get_stats(post.author)
+    paginator = CursorPaginator(
+        post.comments.select_related('author'), COMMENTS_PER_PAGE,
+        field='created'
+    )
+    page = paginator.get_page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
     form = CommentForm()
+    # Templates read the page; the context keeps a QuerySet of the same
+    # comments for code that expects one, never the whole thread.
+    comments = post.comments.filter(pk__in=[item.pk for item in page])
     return render(
         request, 'posts/post.html',
         {'author': post.author, 'post': post, 'form': form,
-         'items': post.comments.all()}
+         'comments': comments, 'items': page}
     )
 
 
@@ -126,11 +228,11 @@ def server_error(request):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = timeline.posts_for(request.user)
+    page, paginator = paginate(
+        request, post_list, lambda: timeline.count_for(request.user),
+        cursor_class=timeline.TimelinePaginator
+    )
     return render(
         request,
         'posts/follow.html',
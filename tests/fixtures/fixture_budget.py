@@ -0,0 +1,19 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def budget():
+    from posts.budgets import budget
+    return budget
+
+
+@pytest.fixture
+def seeded_data(db):
+    from django.core.cache import cache
+
+    from posts import seeding
+    seeding.seed(users=30, posts=300, comments=600, follows=10, groups=3,
+                 prefix='budget', rng=random.Random(0))
+    cache.clear()
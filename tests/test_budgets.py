@@ -0,0 +1,65 @@
+import pytest
+from django.urls import reverse
+
+# Limits for one uncached request on the seeded dataset: SQL queries,
+# model instances built from fetched rows and milliseconds. Raise them
+# deliberately, together with the change that needs more.
+BUDGETS = {
+    # A page of 10 posts with their authors and groups.
+    'index': dict(queries=2, rows=30, ms=500),
+    'group': dict(queries=3, rows=31, ms=500),
+    'profile': dict(queries=2, rows=31, ms=500),
+    'follow_index': dict(queries=4, rows=31, ms=500),
+    'search': dict(queries=2, rows=30, ms=500),
+    # The post and a page of 20 comments with their authors.
+    'post': dict(queries=2, rows=50, ms=500),
+    'new_post': dict(queries=6, rows=10, ms=500),
+    'add_comment': dict(queries=6, rows=10, ms=500),
+}
+
+
+def request_for(name):
+    """``(method, url, data, login)`` of a request to the view ``name``."""
+    from posts.models import Group, Post, UserStats
+    post = Post.objects.select_related('author').order_by(
+        '-comment_count', '-pk'
+    ).first()
+    post_kwargs = {'username': post.author.username, 'post_id': post.pk}
+    if name == 'index':
+        return 'get', reverse('index'), {}, False
+    if name == 'group':
+        return 'get', reverse('group', args=[Group.objects.first().slug]), \
+            {}, False
+    if name == 'profile':
+        author = UserStats.objects.select_related('user').order_by(
+            '-posts_count'
+        ).first().user
+        return 'get', reverse('profile', args=[author.username]), {}, False
+    if name == 'post':
+        return 'get', reverse('post', kwargs=post_kwargs), {}, False
+    if name == 'follow_index':
+        return 'get', reverse('follow_index'), {}, True
+    if name == 'search':
+        return 'get', reverse('search'), {'q': 'кот'}, False
+    if name == 'new_post':
+        return 'post', reverse('new_post'), {'text': 'budget'}, True
+    return 'post', reverse('add_comment', kwargs=post_kwargs), \
+        {'text': 'budget'}, True
+
+
+class TestBudgets:
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('name', list(BUDGETS))
+    def test_view_budget(self, name, client, seeded_data, budget):
+        from posts.models import UserStats
+        method, url, data, login = request_for(name)
+        if login:
+            reader = UserStats.objects.select_related('user').order_by(
+                '-following_count'
+            ).first().user
+            client.force_login(reader)
+        with budget(name, **BUDGETS[name]):
+            response = getattr(client, method)(url, data)
+        assert response.status_code in (200, 302), \
+            f'{url} answered {response.status_code}'
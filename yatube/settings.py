@@ -1,4 +1,6 @@
 import os
+import tempfile
+
 import environ
 
 env = environ.Env()
@@ -28,11 +30,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.profiling.SlowQueryMiddleware',
+    'posts.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -46,7 +51,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'posts.timing.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -55,6 +60,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'posts.context_processors.cache_timeout',
             ],
         },
     },
@@ -112,6 +118,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки пишутся во временный файл по частям; на файле больше
+# POSTS_UPLOAD_MAX_BYTES разбор запроса прерывается (см. posts/images.py)
+FILE_UPLOAD_HANDLERS = ['posts.images.LimitedUploadHandler']
+
+# Ограничения на картинки записей: размер файла, число пикселей
+# (проверяется по заголовку, до декодирования) и длина большей стороны,
+# до которой уменьшается оригинал
+POSTS_UPLOAD_MAX_BYTES = env.int('POSTS_UPLOAD_MAX_BYTES', default=10 * 2 ** 20)
+POSTS_IMAGE_MAX_PIXELS = env.int('POSTS_IMAGE_MAX_PIXELS', default=25 * 10 ** 6)
+POSTS_IMAGE_MAX_SIDE = env.int('POSTS_IMAGE_MAX_SIDE', default=2048)
+
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = 'index'
 
@@ -121,8 +138,87 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')  # noqa
 
 SITE_ID = 1
 
+# Общий для всех воркеров gunicorn кэш. В продакшене задаётся через
+# CACHE_URL (например, rediscache://redis:6379/1), локально и в тестах
+# используется файловый кэш. Redis в docker-compose ограничен по памяти
+# (REDIS_MAXMEMORY) и вытесняет давно не читавшиеся ключи (allkeys-lru).
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    'default': env.cache(
+        'CACHE_URL',
+        default='filecache://' + os.path.join(
+            tempfile.gettempdir(), 'yatube_cache'
+        )
+    ),
+}
+
+# Начиная с какого размера таблицы постов пагинатор на PostgreSQL
+# использует оценку планировщика (pg_class.reltuples) вместо COUNT(*)
+POSTS_COUNT_ESTIMATE_THRESHOLD = 100000
+
+# Сколько ждать пересчёта горячего ключа другим воркером, секунды
+POSTS_CACHE_LOCK_TIMEOUT = 10
+
+# Сколько секунд хранятся страницы, счётчики и карточки записей. Изменения
+# сразу видны благодаря версиям (см. posts/cache.py), а срок нужен, чтобы
+# записи со старыми версиями уходили из кэша.
+POSTS_CACHE_TIMEOUT = env.int('POSTS_CACHE_TIMEOUT', default=600)
+
+# Варианты миниатюр записей: готовятся сразу после загрузки картинки
+# и доступны в шаблонах как post.thumbnails.<вариант> (см. posts/thumbnails.py).
+# Каждый вариант нарезается во всех ширинах и форматах; форматы идут
+# по убыванию предпочтения, последний служит запасным для <img>.
+# AVIF пропускается, если установленный Pillow не умеет его сохранять.
+POSTS_THUMBNAILS = {
+    'card': {
+        'size': (960, 339),
+        'widths': [480, 720, 960],
+        'formats': ['AVIF', 'WEBP', 'JPEG'],
+        'options': {'crop': 'center', 'upscale': True},
+        'sizes': '(min-width: 768px) 690px, 100vw',
+    },
+}
+
+# Потоков для фоновой генерации миниатюр; 0 — генерировать сразу
+# после коммита в том же запросе. SQLite в режиме разработки блокирует
+# всю базу, поэтому там миниатюры по умолчанию готовятся синхронно.
+POSTS_THUMBNAIL_WORKERS = env.int(
+    'POSTS_THUMBNAIL_WORKERS', default=0 if DEBUG else 2
+)
+
+# Материализованная лента подписок (fan-out-on-write)
+TIMELINE_ENABLED = env.bool('TIMELINE_ENABLED', default=False)
+TIMELINE_MAX_LENGTH = env.int('TIMELINE_MAX_LENGTH', default=1000)
+TIMELINE_FANOUT_LIMIT = env.int('TIMELINE_FANOUT_LIMIT', default=5000)
+
+# Доля запросов, для которых измеряются время SQL, шаблонов и кэша
+# (заголовок Server-Timing и строка в журнале posts.timing, см. posts/timing.py).
+# При разработке выключено, чтобы не засорять вывод тестов: задайте
+# POSTS_TIMING_SAMPLE_RATE=1, чтобы измерять каждый запрос.
+POSTS_TIMING_SAMPLE_RATE = env.float(
+    'POSTS_TIMING_SAMPLE_RATE', default=0.0 if DEBUG else 0.01
+)
+
+# Запросы к базе дольше стольких миллисекунд попадают в журнал
+# posts.slow_queries вместе с планом (EXPLAIN) и представлением, 0 — выключено.
+POSTS_SLOW_QUERY_MS = env.float('POSTS_SLOW_QUERY_MS', default=200)
+
+# Писать ли в этот журнал параметры запросов. В них бывают ключи сессий и
+# то, что ввели пользователи, поэтому по умолчанию они скрыты, в том числе
+# в плане.
+POSTS_SLOW_QUERY_PARAMS = env.bool('POSTS_SLOW_QUERY_PARAMS', default=False)
+
+# Интервал между снимками стека в профилировщике ?profile=sample,
+# доступном персоналу сайта (см. posts/profiling.py).
+POSTS_PROFILER_INTERVAL_MS = 1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'posts.timing': {'handlers': ['console'], 'level': 'INFO'},
+        'posts.slow_queries': {'handlers': ['console'], 'level': 'WARNING'},
+    },
 }